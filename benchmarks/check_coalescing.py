@@ -0,0 +1,79 @@
+"""Check coalescing of identical `TextGen` requests against the stub server of `benchmarks/stub_textgen.py`, offline.
+
+Usage:
+    python benchmarks/check_coalescing.py
+
+It checks that concurrent identical requests are sent to the server once, and that cancelling one of the coalesced
+callers, e.g. by `asyncio.wait_for`, doesn't cancel the others. It exits with status 1 if any check failed.
+"""
+import asyncio, sys
+from typing import List
+
+from langchain.globals import set_llm_cache
+
+from langchain_setup.textgen import TextGen
+from stub_textgen import StubTextGenServer
+
+LATENCY = 0.3
+
+
+def check_cancellation(llm: TextGen, server: StubTextGenServer) -> List[str]:
+    async def run():
+        cancelled = asyncio.ensure_future(llm.ainvoke("Cancelled prompt"))
+        other = asyncio.ensure_future(llm.ainvoke("Cancelled prompt"))
+        await asyncio.sleep(LATENCY / 3)
+        cancelled.cancel()
+        timed_out = asyncio.wait_for(llm.ainvoke("Timed out prompt"), LATENCY / 3)
+        timed_out_other = llm.ainvoke("Timed out prompt")
+        return await asyncio.gather(
+            cancelled, other, timed_out, timed_out_other, return_exceptions=True
+        )
+
+    requests = server.requests
+    cancelled, other, timed_out, timed_out_other = asyncio.run(run())
+    failures = []
+    if not isinstance(cancelled, asyncio.CancelledError):
+        failures.append(f"The cancelled caller got {cancelled!r} instead of CancelledError.")
+    if not isinstance(timed_out, asyncio.TimeoutError):
+        failures.append(f"The timed out caller got {timed_out!r} instead of TimeoutError.")
+    for name, result in [("cancelled", other), ("timed out", timed_out_other)]:
+        if not isinstance(result, str):
+            failures.append(f"A caller coalesced with the {name} one got {result!r} instead of the result.")
+    if server.requests - requests != 2:
+        failures.append(f"{server.requests - requests} requests were sent to the server, expected 2.")
+    return failures
+
+
+def check_coalescing(llm: TextGen, server: StubTextGenServer) -> List[str]:
+    async def run():
+        return await asyncio.gather(*(llm.ainvoke("Same prompt") for _ in range(8)))
+
+    requests = server.requests
+    results = asyncio.run(run())
+    failures = []
+    if len(set(results)) != 1:
+        failures.append(f"Coalesced callers got different results: {results}.")
+    if server.requests - requests != 1:
+        failures.append(f"{server.requests - requests} requests were sent to the server, expected 1.")
+    return failures
+
+
+def main():
+    set_llm_cache(None)
+    with StubTextGenServer(latency=LATENCY) as server:
+        llm = TextGen(
+            host_name_or_address=server.host,
+            api_blocking_port=server.blocking_port,
+            api_streaming_port=server.streaming_port,
+        )
+        llm.invoke("Warm up")  # The model info is fetched once, and is not counted as a generation.
+        failures = check_coalescing(llm, server) + check_cancellation(llm, server)
+    for failure in failures:
+        print(failure)
+    if not failures:
+        print("Coalescing of TextGen works.")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""Check load balancing of `TextGen` over several stub servers of `benchmarks/stub_textgen.py`, offline.
+
+Usage:
+    python benchmarks/check_textgen_backends.py
+
+It checks that:
+    1. Requests are balanced between healthy backends, and no request is left in flight.
+    2. Requests to a dead backend are sent to a healthy one, and the dead backend is ejected after
+       `backend_max_failures` failures.
+    3. The ejected backend is admitted again after `backend_cooldown` seconds.
+It exits with status 1 if any check failed.
+"""
+import asyncio, socket, sys, time
+from typing import List
+
+from langchain.globals import set_llm_cache
+
+from langchain_setup.textgen import TextGen
+from stub_textgen import StubTextGenServer
+
+PROMPTS = 16
+BACKEND_MAX_FAILURES = 2
+BACKEND_COOLDOWN = 1
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def backend_spec(server: StubTextGenServer) -> str:
+    return f"{server.host}:{server.blocking_port}:{server.streaming_port}"
+
+
+def create_llm(backends: List[str]) -> TextGen:
+    return TextGen(
+        backends=backends,
+        backend_max_failures=BACKEND_MAX_FAILURES,
+        backend_cooldown=BACKEND_COOLDOWN,
+        retry_backoff_factor=0.01,
+        max_concurrency=8,
+    )
+
+
+def check_balancing(servers: List[StubTextGenServer]) -> List[str]:
+    llm = create_llm([backend_spec(server) for server in servers])
+    requests = [server.requests for server in servers]
+    llm.batch([f"Balanced prompt {i}" for i in range(PROMPTS)])
+    asyncio.run(llm.abatch([f"Async balanced prompt {i}" for i in range(PROMPTS)]))
+
+    failures = []
+    counts = [server.requests - count for server, count in zip(servers, requests)]
+    if max(counts) - min(counts) > PROMPTS // 4:
+        failures.append(f"Requests are not balanced between backends: {counts}.")
+    in_flight = [stats["in_flight"] for stats in llm.backend_stats]
+    if any(in_flight):
+        failures.append(f"Requests are left in flight: {in_flight}.")
+    return failures
+
+
+def check_failover(servers: List[StubTextGenServer]) -> List[str]:
+    dead_port = free_port()
+    dead_backend = f"127.0.0.1:{dead_port}:{free_port()}"
+    llm = create_llm([backend_spec(server) for server in servers] + [dead_backend])
+
+    failures = []
+    for name, generate in [
+        ("batch", lambda prompts: llm.batch(prompts)),
+        ("abatch", lambda prompts: asyncio.run(llm.abatch(prompts))),
+    ]:
+        try:
+            generate([f"Failover prompt {name} {i}" for i in range(PROMPTS)])
+        except Exception as e:
+            failures.append(f"{name} failed although healthy backends were available: {e!r}")
+    dead_stats = llm.backend_stats[-1]
+    if not dead_stats["ejected"]:
+        failures.append(f"The dead backend is not ejected: {dead_stats}.")
+    elif dead_stats["failures"] < BACKEND_MAX_FAILURES:
+        failures.append(f"The dead backend is ejected before {BACKEND_MAX_FAILURES} failures: {dead_stats}.")
+
+    # The dead backend comes back on the same port.
+    with StubTextGenServer(latency=0.01, blocking_port=dead_port) as revived:
+        time.sleep(BACKEND_COOLDOWN)
+        llm.batch([f"Readmission prompt {i}" for i in range(PROMPTS)])
+        if revived.requests == 0:
+            failures.append(f"The backend is not admitted again after {BACKEND_COOLDOWN} seconds.")
+        if llm.backend_stats[-1]["ejected"]:
+            failures.append("The backend is still ejected after it came back.")
+    return failures
+
+
+def main():
+    set_llm_cache(None)
+    with StubTextGenServer(latency=0.05) as first, StubTextGenServer(latency=0.05) as second:
+        failures = check_balancing([first, second]) + check_failover([first, second])
+    for failure in failures:
+        print(failure)
+    if not failures:
+        print("Load balancing of TextGen works.")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""Check streaming of `TextGen` against the stub server of `benchmarks/stub_textgen.py`, offline.
+
+Usage:
+    python benchmarks/check_textgen_streaming.py
+
+It checks that `stream` and `astream` yield every token of the stub and call `on_llm_new_token` for each one, and
+that a stalled server raises after `request_timeout` instead of hanging. It exits with status 1 if any check failed.
+"""
+import asyncio, sys, time
+from typing import Any, List
+
+from langchain.callbacks.base import BaseCallbackHandler
+
+from langchain_setup.textgen import TextGen
+from stub_textgen import StubTextGenServer
+
+TOKENS = 5
+REQUEST_TIMEOUT = 0.5
+STALLED_LATENCY = 3
+
+
+class TokenCollector(BaseCallbackHandler):
+    def __init__(self):
+        self.tokens: List[str] = []
+
+    def on_llm_new_token(self, token: str, **kwargs: Any) -> None:
+        self.tokens.append(token)
+
+
+def create_llm(server: StubTextGenServer, **kwargs) -> TextGen:
+    return TextGen(
+        host_name_or_address=server.host,
+        api_blocking_port=server.blocking_port,
+        api_streaming_port=server.streaming_port,
+        **kwargs,
+    )
+
+
+def check_tokens(name: str, chunks: List[str], collector: TokenCollector) -> List[str]:
+    expected = [f" token{i}" for i in range(TOKENS)]
+    failures = []
+    if chunks != expected:
+        failures.append(f"{name} yielded {chunks}, expected {expected}.")
+    if collector.tokens != expected:
+        failures.append(f"{name} called on_llm_new_token with {collector.tokens}, expected {expected}.")
+    return failures
+
+
+def check_streaming() -> List[str]:
+    failures = []
+    with StubTextGenServer(latency=0.01, token_latency=0.001, tokens=TOKENS) as server:
+        llm = create_llm(server)
+
+        collector = TokenCollector()
+        chunks = list(llm.stream("Hi", config={"callbacks": [collector]}))
+        failures += check_tokens("stream", chunks, collector)
+
+        async def astream():
+            return [chunk async for chunk in llm.astream("Hi", config={"callbacks": [collector]})]
+
+        collector = TokenCollector()
+        chunks = asyncio.run(astream())
+        failures += check_tokens("astream", chunks, collector)
+    return failures
+
+
+def check_timeout() -> List[str]:
+    failures = []
+    with StubTextGenServer(latency=STALLED_LATENCY) as server:
+        llm = create_llm(server, request_timeout=REQUEST_TIMEOUT)
+
+        async def astream():
+            return [chunk async for chunk in llm.astream("Hi")]
+
+        streams = [
+            ("stream", lambda: list(llm.stream("Hi"))),
+            ("astream", lambda: asyncio.run(astream())),
+        ]
+        for name, stream in streams:
+            start = time.perf_counter()
+            try:
+                stream()
+                failures.append(f"{name} of a stalled server didn't raise.")
+            except Exception as e:
+                elapsed = time.perf_counter() - start
+                if elapsed >= STALLED_LATENCY:
+                    failures.append(f"{name} of a stalled server raised {e!r} only after {elapsed:.1f} s.")
+    return failures
+
+
+def main():
+    failures = check_streaming() + check_timeout()
+    for failure in failures:
+        print(failure)
+    if not failures:
+        print("Streaming of TextGen works.")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
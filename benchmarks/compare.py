@@ -0,0 +1,59 @@
+"""Compare two results of `benchmarks/run_all.py`, and guard against regressions.
+
+Usage:
+    python benchmarks/compare.py benchmarks/results/<base>.json benchmarks/results/<head>.json [--threshold 10]
+
+Metrics ending with `_per_second` are better when higher, and the others (times and memory) when lower. It exits with
+status 1 if any metric regressed by more than `--threshold` percent.
+"""
+import argparse, json, sys
+
+
+def is_higher_better(name: str) -> bool:
+    return name.endswith("_per_second")
+
+
+def compare(base: dict, head: dict, threshold: float):
+    """Yield (name, base value, head value, change in %, whether it regressed) of metrics in both results."""
+    for name, base_value in base["metrics"].items():
+        head_value = head["metrics"].get(name)
+        if head_value is None or not base_value:
+            continue
+        change = (head_value - base_value) / base_value * 100
+        regression = -change if is_higher_better(name) else change
+        yield name, base_value, head_value, change, regression > threshold
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("base")
+    parser.add_argument("head")
+    parser.add_argument(
+        "--threshold", type=float, default=10, help="Percent of change counted as a regression."
+    )
+    args = parser.parse_args()
+
+    with open(args.base) as f:
+        base = json.load(f)
+    with open(args.head) as f:
+        head = json.load(f)
+
+    print(f"base: {(base.get('commit') or 'unknown')[:12]}{' (dirty)' if base.get('dirty') else ''}")
+    print(f"head: {(head.get('commit') or 'unknown')[:12]}{' (dirty)' if head.get('dirty') else ''}")
+    print(f"{'metric':<40}{'base':>12}{'head':>12}{'change':>10}")
+    regressions = []
+    for name, base_value, head_value, change, regressed in compare(base, head, args.threshold):
+        print(
+            f"{name:<40}{base_value:>12.2f}{head_value:>12.2f}{change:>+9.1f}%"
+            f"{'  REGRESSED' if regressed else ''}"
+        )
+        if regressed:
+            regressions.append(name)
+
+    if regressions:
+        print(f"Regressed by more than {args.threshold}%: {', '.join(regressions)}.")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
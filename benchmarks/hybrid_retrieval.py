@@ -0,0 +1,122 @@
+"""Benchmark query latency of `HybridRetriever` against `EnsembleRetriever` of `BM25Retriever` and a Qdrant retriever.
+
+Usage:
+    python benchmarks/hybrid_retrieval.py [--documents 20000] [--queries 50] [--json]
+
+The corpus is synthetic, with word frequencies following Zipf's law, and is embedded by a deterministic fake
+embedder into an in-memory Qdrant, so nothing is sent to the network.
+"""
+import argparse, json, random, time
+
+from langchain.embeddings import DeterministicFakeEmbedding
+from langchain.retrievers import BM25Retriever, EnsembleRetriever
+from langchain.schema import Document
+
+from langchain_setup.hybrid import BM25SparseRetriever, HybridRetriever
+from langchain_setup.ingestion import ingest_documents
+from langchain_setup.qdrant import create_empty_qdrant
+
+VOCABULARY_SIZE = 50_000
+
+
+def make_corpus(documents: int, seed: int = 0):
+    rng = random.Random(seed)
+    words = [f"w{i}" for i in range(VOCABULARY_SIZE)]
+    zipf_weights = [1 / (rank + 1) for rank in range(VOCABULARY_SIZE)]
+    texts = [
+        " ".join(rng.choices(words, zipf_weights, k=rng.randint(50, 150)))
+        for _ in range(documents)
+    ]
+    queries = [
+        " ".join(rng.choices(words, zipf_weights, k=rng.randint(3, 8)))
+        for _ in range(100)
+    ]
+    return texts, queries
+
+
+def time_queries(retriever, queries):
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        retriever.get_relevant_documents(query)
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    return {
+        "query_p50_ms": latencies[len(latencies) // 2] * 1000,
+        "query_p95_ms": latencies[int(len(latencies) * 0.95)] * 1000,
+    }
+
+
+def timed(fn):
+    start = time.perf_counter()
+    return fn(), time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--documents", type=int, default=20000)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--json", action="store_true", help="Print results as JSON.")
+    args = parser.parse_args()
+
+    texts, queries = make_corpus(args.documents)
+    queries = queries[: args.queries]
+    documents = [Document(page_content=text) for text in texts]
+    vectorstore = create_empty_qdrant(
+        DeterministicFakeEmbedding(size=64), cache_embeddings=False, location=":memory:"
+    )
+    ingest_documents(vectorstore, documents)
+    # Same number of documents from each side before fusion.
+    vector_retriever = vectorstore.as_retriever(search_kwargs={"k": 20})
+
+    bm25, bm25_build_seconds = timed(lambda: BM25Retriever.from_documents(documents, k=20))
+    sparse_bm25, sparse_bm25_build_seconds = timed(
+        lambda: BM25SparseRetriever.from_documents(documents, k=20)
+    )
+    sparse_bm25.get_relevant_documents("warm up")  # Build the weights
+    results = [
+        {
+            "retriever": "BM25Retriever",
+            "build_seconds": bm25_build_seconds,
+            **time_queries(bm25, queries),
+        },
+        {
+            "retriever": "BM25SparseRetriever",
+            "build_seconds": sparse_bm25_build_seconds,
+            **time_queries(sparse_bm25, queries),
+        },
+        {
+            "retriever": "EnsembleRetriever",
+            **time_queries(
+                EnsembleRetriever(retrievers=[bm25, vector_retriever], weights=[0.5, 0.5]),
+                queries,
+            ),
+        },
+        {
+            "retriever": "HybridRetriever",
+            **time_queries(
+                HybridRetriever(
+                    vectorstore=vectorstore, bm25=sparse_bm25.index, k=args.k, fetch_k=20
+                ),
+                queries,
+            ),
+        },
+    ]
+
+    if args.json:
+        print(json.dumps({"documents": args.documents, "results": results}, indent=1))
+        return
+    print(f"{args.documents} documents, {len(queries)} queries")
+    print(f"{'retriever':<22}{'build s':>10}{'p50 ms':>10}{'p95 ms':>10}")
+    for result in results:
+        build_seconds = result.get("build_seconds")
+        print(
+            f"{result['retriever']:<22}"
+            f"{'-' if build_seconds is None else f'{build_seconds:.2f}':>10}"
+            f"{result['query_p50_ms']:>10.2f}{result['query_p95_ms']:>10.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""Benchmark the time of importing the light parts of `langchain_setup`, and guard against regressions.
+
+Usage:
+    python benchmarks/import_time.py [--repeat 10] [--max-ms 200]
+
+It exits with status 1 if the fastest import is slower than `--max-ms`, or if importing the light parts also imports
+heavy packages, which should only be imported when the attributes needing them are accessed.
+"""
+import argparse, json, subprocess, sys
+
+STATEMENT = "from langchain_setup import pprint_documents, wrap_print"
+HEAVY_MODULES = ["langchain", "requests", "qdrant_client", "openai"]
+
+SCRIPT = f"""
+import json, sys, time
+start = time.perf_counter()
+{STATEMENT}
+elapsed = time.perf_counter() - start
+print(json.dumps({{
+    "seconds": elapsed,
+    "heavy_modules": [m for m in {HEAVY_MODULES!r} if m in sys.modules],
+}}))
+"""
+
+
+def measure(repeat: int):
+    # Every import is measured in a new interpreter, otherwise modules are already cached in `sys.modules`.
+    results = []
+    for _ in range(repeat):
+        output = subprocess.run(
+            [sys.executable, "-c", SCRIPT], capture_output=True, text=True, check=True
+        ).stdout
+        results.append(json.loads(output.splitlines()[-1]))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--max-ms", type=float, default=200)
+    args = parser.parse_args()
+
+    results = measure(args.repeat)
+    timings = sorted(result["seconds"] * 1000 for result in results)
+    heavy_modules = results[0]["heavy_modules"]
+    print(
+        f"`{STATEMENT}`: "
+        f"min {timings[0]:.1f} ms, median {timings[len(timings) // 2]:.1f} ms, max {timings[-1]:.1f} ms"
+    )
+
+    failed = False
+    if timings[0] > args.max_ms:
+        print(f"Import time regressed: {timings[0]:.1f} ms > {args.max_ms} ms.")
+        failed = True
+    if heavy_modules:
+        print(f"Heavy modules are imported eagerly: {heavy_modules}.")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""Benchmark the in-memory Qdrant of `create_inmemory_empty_qdrant` against the persistent one of
+`create_persistent_qdrant`: build time, reopen time, query latency and peak RSS.
+
+Usage:
+    python benchmarks/qdrant_storage.py [--documents 20000] [--dimension 384] [--queries 200] [--json]
+
+Documents are embedded by a deterministic fake embedder, so nothing is sent to the network. Every mode runs in a new
+interpreter, so that peak RSS of one mode doesn't include another.
+"""
+import argparse, json, subprocess, sys, tempfile
+
+MODES = ["memory", "persistent", "persistent-reopen"]
+
+SCRIPT = """
+import json, resource, sys, time
+from langchain.embeddings import DeterministicFakeEmbedding
+from langchain.schema import Document
+from langchain_setup.ingestion import ingest_documents
+from langchain_setup.qdrant import create_empty_qdrant, create_persistent_qdrant
+
+mode, path, documents, dimension, queries = sys.argv[1:]
+documents, dimension, queries = int(documents), int(dimension), int(queries)
+embedding = DeterministicFakeEmbedding(size=dimension)
+
+start = time.perf_counter()
+if mode == "memory":
+    vectorstore = create_empty_qdrant(embedding, cache_embeddings=False, location=":memory:")
+else:
+    vectorstore = create_persistent_qdrant("benchmark", embedding, path=path, cache_embeddings=False)
+build_seconds = None
+if mode != "persistent-reopen":
+    ingest_documents(vectorstore, (Document(page_content=f"document {i}") for i in range(documents)))
+    build_seconds = time.perf_counter() - start
+open_seconds = time.perf_counter() - start
+
+vectors = embedding.embed_documents([f"query {i}" for i in range(queries)])
+latencies = []
+for vector in vectors:
+    start = time.perf_counter()
+    vectorstore.similarity_search_by_vector(vector, k=4)
+    latencies.append(time.perf_counter() - start)
+latencies.sort()
+print(json.dumps({
+    "mode": mode,
+    "points": vectorstore.client.count(vectorstore.collection_name).count,
+    "build_seconds": build_seconds,
+    "open_seconds": open_seconds,
+    "query_p50_ms": latencies[len(latencies) // 2] * 1000,
+    "query_p95_ms": latencies[int(len(latencies) * 0.95)] * 1000,
+    "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+}))
+"""
+
+
+def measure(documents: int, dimension: int, queries: int):
+    results = []
+    with tempfile.TemporaryDirectory() as path:
+        # "persistent-reopen" reopens the collection built by "persistent", embedding nothing.
+        for mode in MODES:
+            output = subprocess.run(
+                [sys.executable, "-c", SCRIPT, mode, path]
+                + [str(documents), str(dimension), str(queries)],
+                capture_output=True,
+                text=True,
+                check=True,
+            ).stdout
+            results.append(json.loads(output.splitlines()[-1]))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--documents", type=int, default=20000)
+    parser.add_argument("--dimension", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--json", action="store_true", help="Print results as JSON.")
+    args = parser.parse_args()
+
+    results = measure(args.documents, args.dimension, args.queries)
+    if args.json:
+        print(json.dumps(results, indent=1))
+        return
+
+    print(
+        f"{'mode':<20}{'points':>8}{'build s':>10}{'open s':>10}"
+        f"{'p50 ms':>10}{'p95 ms':>10}{'peak RSS MB':>14}"
+    )
+    for result in results:
+        build_seconds = result["build_seconds"]
+        print(
+            f"{result['mode']:<20}{result['points']:>8}"
+            f"{'-' if build_seconds is None else f'{build_seconds:.2f}':>10}"
+            f"{result['open_seconds']:>10.2f}{result['query_p50_ms']:>10.2f}"
+            f"{result['query_p95_ms']:>10.2f}{result['peak_rss_mb']:>14.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
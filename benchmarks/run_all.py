@@ -0,0 +1,191 @@
+"""Run the offline benchmark suite and write the results as JSON, to compare them between commits with
+`benchmarks/compare.py`.
+
+Usage:
+    python benchmarks/run_all.py [--output benchmarks/results/<commit>.json] [--quick]
+
+Nothing is sent to the network: `TextGen` talks to the stub server of `benchmarks/stub_textgen.py`, documents are
+embedded by `DeterministicFakeEmbedding`, and Qdrant runs in local mode in a temporary folder.
+
+Measured:
+    import_ms: Fastest import of the light parts of `langchain_setup`, see `benchmarks/import_time.py`.
+    textgen_*: Latency of sequential requests, requests per second of concurrent requests, and time to first token
+        of streamed requests.
+    ingestion_documents_per_second, query_*: Ingestion with `ingest_documents` and similarity search.
+    pprint_documents_*: Time and peak memory of printing documents.
+    peak_rss_mb: Peak resident memory of the whole run.
+"""
+import argparse, asyncio, contextlib, datetime, json, os, platform, resource, subprocess
+import tempfile, time, tracemalloc
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+import import_time
+from stub_textgen import StubTextGenServer
+
+RESULTS_DIR = Path(__file__).parent / "results"
+
+
+def _percentile(values: List[float], percentile: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percentile / 100))]
+
+
+def _timed(function: Callable[[], Any]) -> float:
+    start = time.perf_counter()
+    function()
+    return time.perf_counter() - start
+
+
+def bench_import(repeat: int) -> Dict[str, float]:
+    timings = sorted(result["seconds"] * 1000 for result in import_time.measure(repeat))
+    return {"import_ms": timings[0]}
+
+
+def bench_textgen(requests: int, concurrency: int, latency: float) -> Dict[str, float]:
+    from langchain.globals import set_llm_cache
+    from langchain_setup.textgen import TextGen
+
+    # Prompts are all different, so that neither the LLM cache nor request coalescing answers without the server.
+    set_llm_cache(None)
+    with StubTextGenServer(latency=latency) as server:
+        llm = TextGen(
+            host_name_or_address=server.host,
+            api_blocking_port=server.blocking_port,
+            api_streaming_port=server.streaming_port,
+            max_concurrency=concurrency,
+        )
+        llm.invoke("warm up")  # Connections and the model info are not part of the latency.
+
+        latencies = [_timed(lambda: llm.invoke(f"sequential {i}")) for i in range(requests)]
+
+        prompts = [f"concurrent {i}" for i in range(requests * 4)]
+        batch_seconds = _timed(
+            lambda: llm.batch(prompts, config={"max_concurrency": concurrency})
+        )
+
+        async def agenerate():
+            await llm.ainvoke("warm up async")
+            return await asyncio.gather(*(llm.ainvoke(f"async {prompt}") for prompt in prompts))
+
+        async_seconds = _timed(lambda: asyncio.run(agenerate()))
+
+        first_token_latencies = []
+        for i in range(requests):
+            start = time.perf_counter()
+            for _ in llm.stream(f"streaming {i}"):
+                first_token_latencies.append(time.perf_counter() - start)
+                break
+    return {
+        "textgen_latency_p50_ms": _percentile(latencies, 50) * 1000,
+        "textgen_latency_p95_ms": _percentile(latencies, 95) * 1000,
+        "textgen_batch_requests_per_second": len(prompts) / batch_seconds,
+        "textgen_async_requests_per_second": len(prompts) / async_seconds,
+        "textgen_first_token_p50_ms": _percentile(first_token_latencies, 50) * 1000,
+        "textgen_first_token_p95_ms": _percentile(first_token_latencies, 95) * 1000,
+    }
+
+
+def bench_qdrant(documents: int, queries: int, dimension: int) -> Dict[str, float]:
+    from langchain.embeddings import DeterministicFakeEmbedding
+    from langchain.schema import Document
+    from langchain_setup.ingestion import ingest_documents
+    from langchain_setup.qdrant import create_persistent_qdrant
+
+    embedding = DeterministicFakeEmbedding(size=dimension)
+    with tempfile.TemporaryDirectory() as path:
+        vectorstore = create_persistent_qdrant(
+            "benchmark", embedding, path=path, cache_embeddings=False
+        )
+        stats = ingest_documents(
+            vectorstore,
+            (
+                Document(page_content=f"document {i}", metadata={"index": i})
+                for i in range(documents)
+            ),
+        )
+        vectors = embedding.embed_documents([f"query {i}" for i in range(queries)])
+        latencies = [
+            _timed(lambda: vectorstore.similarity_search_by_vector(vector, k=4))
+            for vector in vectors
+        ]
+        vectorstore.client.close()
+    return {
+        "ingestion_documents_per_second": stats.documents_per_second,
+        "query_p50_ms": _percentile(latencies, 50) * 1000,
+        "query_p95_ms": _percentile(latencies, 95) * 1000,
+    }
+
+
+def bench_pprint(documents: int) -> Dict[str, float]:
+    from langchain.schema import Document
+    from langchain_setup import pprint_documents
+
+    document_list = [
+        Document(
+            page_content=f"Paragraph {i}. " + "lorem ipsum dolor sit amet " * 40,
+            metadata={"source": f"page_{i}.md", "index": i},
+        )
+        for i in range(documents)
+    ]
+    # Printed to /dev/null, so that the peak memory is not that of the captured output.
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        # The fastest of a few runs, which is less noisy than a single run.
+        seconds = min(_timed(lambda: pprint_documents(document_list)) for _ in range(5))
+        # Measured apart, because tracing allocations slows printing down.
+        tracemalloc.start()
+        pprint_documents(document_list)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return {"pprint_documents_ms": seconds * 1000, "pprint_documents_peak_mb": peak / 2**20}
+
+
+def _git(*args: str) -> str:
+    return subprocess.run(
+        ["git", *args], capture_output=True, text=True, cwd=Path(__file__).parent
+    ).stdout.strip()
+
+
+def run(quick: bool = False) -> Dict[str, Any]:
+    scale = 0.1 if quick else 1
+    metrics: Dict[str, float] = {}
+    metrics.update(bench_import(repeat=3 if quick else 10))
+    metrics.update(bench_textgen(requests=int(50 * scale) or 5, concurrency=8, latency=0.02))
+    metrics.update(bench_qdrant(documents=int(5000 * scale), queries=200, dimension=384))
+    metrics.update(bench_pprint(documents=int(2000 * scale)))
+    metrics["peak_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return {
+        "commit": _git("rev-parse", "HEAD") or None,
+        "dirty": bool(_git("status", "--porcelain", "--untracked-files=no")),
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "quick": quick,
+        "metrics": metrics,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--output", type=Path, help="Default to `benchmarks/results/<commit>.json`."
+    )
+    parser.add_argument(
+        "--quick", action="store_true", help="Run 10 times fewer requests and documents."
+    )
+    args = parser.parse_args()
+
+    results = run(args.quick)
+    output = args.output or RESULTS_DIR / f"{(results['commit'] or 'unknown')[:12]}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(results, indent=1))
+
+    for name, value in results["metrics"].items():
+        print(f"{name:<40}{value:>12.2f}")
+    print(f"Results are written to {output}")
+
+
+if __name__ == "__main__":
+    main()
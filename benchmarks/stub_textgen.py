@@ -0,0 +1,183 @@
+"""Stub of the text-generation-webui API, answering with fixed latency, for benchmarking `TextGen` offline.
+
+It serves the blocking API (`POST /api/v1/generate`, `POST /api/v1/model`) over HTTP and the streaming API
+(`/api/v1/stream`) over websocket, like text-generation-webui started with `--api`.
+
+Usage:
+    python benchmarks/stub_textgen.py [--blocking-port 5000] [--streaming-port 5005] [--latency 0.05]
+
+Or in a benchmark:
+    with StubTextGenServer(latency=0.05) as server:
+        llm = TextGen(host_name_or_address="127.0.0.1", api_blocking_port=server.blocking_port,
+                      api_streaming_port=server.streaming_port)
+"""
+import argparse, asyncio, json, threading, time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+MODEL_NAME = "stub-model"
+
+
+class StubTextGenServer:
+    def __init__(
+        self,
+        latency: float = 0.05,
+        token_latency: float = 0.005,
+        tokens: int = 20,
+        host: str = "127.0.0.1",
+        blocking_port: int = 0,
+        streaming_port: int = 0,
+    ):
+        """
+        Args:
+            latency: Seconds before the first token, i.e. time of processing the prompt.
+            token_latency: Seconds of generating every token.
+            tokens: Number of tokens generated, at most `max_new_tokens` of the request.
+            blocking_port, streaming_port: 0 means any free port.
+        """
+        self.latency = latency
+        self.token_latency = token_latency
+        self.tokens = tokens
+        self.host = host
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._http_server = ThreadingHTTPServer((host, blocking_port), self._handler())
+        self._http_server.daemon_threads = True
+        self._streaming_port = streaming_port
+        self._loop = None
+        self._websocket_server = None
+        self._started = threading.Event()
+        self._threads = []
+
+    @property
+    def blocking_port(self) -> int:
+        return self._http_server.server_address[1]
+
+    @property
+    def streaming_port(self) -> int:
+        return self._websocket_server.sockets[0].getsockname()[1]
+
+    def generate(self, request: dict):
+        """Yield tokens of the answer to the request, taking the time of a real model."""
+        with self._lock:
+            self.requests += 1
+        time.sleep(self.latency)
+        for i in range(min(self.tokens, request.get("max_new_tokens") or self.tokens)):
+            time.sleep(self.token_latency)
+            yield f" token{i}"
+
+    def start(self):
+        http_thread = threading.Thread(target=self._http_server.serve_forever, daemon=True)
+        websocket_thread = threading.Thread(target=self._serve_websocket, daemon=True)
+        self._threads = [http_thread, websocket_thread]
+        for thread in self._threads:
+            thread.start()
+        self._started.wait()
+        if self._websocket_server is None:
+            self.stop()
+            raise RuntimeError("Failed at starting the streaming API.")
+        return self
+
+    def stop(self):
+        self._http_server.shutdown()
+        self._http_server.server_close()
+        if self._loop:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+        for thread in self._threads:
+            thread.join(timeout=5)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # Keep-alive, as a real server behind `TextGen`'s pooled sessions
+
+            def do_POST(self):
+                request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                if self.path == "/api/v1/generate":
+                    text = "".join(server.generate(request))
+                    self._send({"results": [{"text": text}]})
+                elif self.path == "/api/v1/model":
+                    self._send({"result": {"model_name": MODEL_NAME, "lora_names": []}})
+                else:
+                    self.send_error(404)
+
+            def _send(self, body: dict):
+                data = json.dumps(body).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def _serve_websocket(self):
+        import websockets
+
+        async def stream(websocket, path=None):
+            request = json.loads(await websocket.recv())
+            # Tokens are generated in a thread, so that the latency doesn't block other streams.
+            generator = self.generate(request)
+            try:
+                while True:
+                    token = await asyncio.to_thread(next, generator, None)
+                    if token is None:
+                        break
+                    await websocket.send(json.dumps({"event": "text_stream", "text": token}))
+                await websocket.send(json.dumps({"event": "stream_end"}))
+            except websockets.ConnectionClosed:
+                pass  # The client stopped reading, e.g. after the first token.
+
+        async def serve():
+            # Recent versions of websockets create the server in the running event loop.
+            return await websockets.serve(stream, self.host, self._streaming_port)
+
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        try:
+            self._websocket_server = self._loop.run_until_complete(serve())
+        finally:
+            self._started.set()
+        self._loop.run_forever()
+        self._websocket_server.close()
+        self._loop.run_until_complete(self._websocket_server.wait_closed())
+        self._loop.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--blocking-port", type=int, default=5000)
+    parser.add_argument("--streaming-port", type=int, default=5005)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--token-latency", type=float, default=0.005)
+    parser.add_argument("--tokens", type=int, default=20)
+    args = parser.parse_args()
+
+    with StubTextGenServer(
+        args.latency,
+        args.token_latency,
+        args.tokens,
+        blocking_port=args.blocking_port,
+        streaming_port=args.streaming_port,
+    ) as server:
+        print(
+            f"Serving the blocking API on port {server.blocking_port} "
+            f"and the streaming API on port {server.streaming_port}."
+        )
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""Benchmark calls and wall time of `MapReduceSummarizer` against `load_summarize_chain(chain_type="map_reduce")` set
+up as in `Use cases/3. Summarization`.
+
+Usage:
+    python benchmarks/summarization.py [--pages 200] [--latency 0.005] [--max-concurrency 8] [--json]
+
+A fake LLM answering after `--latency` seconds stands for the model, so nothing is sent to the network.
+Results are also scaled to 1k pages.
+"""
+import argparse, asyncio, json, random, time
+from typing import Any, List, Optional
+
+from langchain.chains.summarize import load_summarize_chain
+from langchain.llms.base import LLM
+from langchain.schema import Document
+from langchain.text_splitter import MarkdownTextSplitter
+
+from langchain_setup.summarization import MapReduceSummarizer
+from langchain_setup.tokens import estimate_tokens
+
+PAGE_CHARACTERS = 2000
+SUMMARY = "summary " * 30
+
+
+class FakeLLM(LLM):
+    latency: float
+    calls: int = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake"
+
+    def _call(self, prompt: str, stop: Optional[List[str]] = None, **kwargs: Any) -> str:
+        self.calls += 1
+        time.sleep(self.latency)
+        return SUMMARY
+
+    async def _acall(self, prompt: str, stop: Optional[List[str]] = None, **kwargs: Any) -> str:
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        return SUMMARY
+
+    def get_num_tokens(self, text: str) -> int:
+        return estimate_tokens(text)
+
+
+def make_pages(pages: int, seed: int = 0) -> List[Document]:
+    rng = random.Random(seed)
+    words = ["lorem", "ipsum", "dolor", "sit", "amet", "consectetur", "adipiscing", "elit"]
+    documents = []
+    for i in range(pages):
+        paragraphs = []
+        while sum(len(p) for p in paragraphs) < PAGE_CHARACTERS:
+            paragraphs.append(" ".join(rng.choices(words, k=rng.randint(20, 60))))
+        documents.append(Document(page_content="\n\n".join(paragraphs), metadata={"page": i}))
+    return documents
+
+
+def run_chain(pages: List[Document], latency: float):
+    llm = FakeLLM(latency=latency)
+    splits = MarkdownTextSplitter(chunk_size=500, chunk_overlap=200).split_documents(pages)
+    chain = load_summarize_chain(llm=llm, chain_type="map_reduce")
+    start = time.perf_counter()
+    chain.run(splits)
+    return {"calls": llm.calls, "seconds": time.perf_counter() - start}
+
+
+def run_summarizer(pages: List[Document], latency: float, max_concurrency: int):
+    llm = FakeLLM(latency=latency)
+    summarizer = MapReduceSummarizer(
+        llm, max_concurrency=max_concurrency, count_tokens=llm.get_num_tokens
+    )
+    start = time.perf_counter()
+    summarizer.summarize(pages)
+    return {
+        "calls": llm.calls,
+        "seconds": time.perf_counter() - start,
+        "collapse_levels": summarizer.stats.collapse_levels,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--pages", type=int, default=200)
+    parser.add_argument(
+        "--latency", type=float, default=0.005, help="Seconds of every call of the fake LLM."
+    )
+    parser.add_argument("--max-concurrency", type=int, default=8)
+    parser.add_argument("--json", action="store_true", help="Print results as JSON.")
+    args = parser.parse_args()
+
+    pages = make_pages(args.pages)
+    results = [
+        {"runner": "load_summarize_chain", **run_chain(pages, args.latency)},
+        {
+            "runner": "MapReduceSummarizer",
+            **run_summarizer(pages, args.latency, args.max_concurrency),
+        },
+    ]
+    scale = 1000 / args.pages
+    for result in results:
+        result["calls_per_1k_pages"] = result["calls"] * scale
+        result["seconds_per_1k_pages"] = result["seconds"] * scale
+
+    if args.json:
+        print(
+            json.dumps(
+                {"pages": args.pages, "latency": args.latency, "results": results},
+                indent=1,
+            )
+        )
+        return
+    print(f"{args.pages} pages, {args.latency * 1000:.0f} ms per call")
+    print(f"{'runner':<24}{'calls':>8}{'seconds':>10}{'calls/1k pages':>16}{'s/1k pages':>12}")
+    for result in results:
+        print(
+            f"{result['runner']:<24}{result['calls']:>8}{result['seconds']:>10.2f}"
+            f"{result['calls_per_1k_pages']:>16.0f}{result['seconds_per_1k_pages']:>12.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -28,12 +28,23 @@ load_environment_variables()
 # ================================================
 # Disabling verification warnings
 # ================================================
-import warnings
-from urllib3.exceptions import InsecureRequestWarning
-from requests import Session
+import importlib.abc, importlib.util, sys, warnings
 
 
 def disable_ssl_verification():
+    # Importing `requests` takes time, so patch it only after it is imported by whoever needs it.
+    if "requests" in sys.modules:
+        _patch_requests_session()
+    else:
+        sys.meta_path.insert(0, _PatchAfterImportingRequests())
+
+    # Diabling SSL verification trigger InsecureRequestWarning for every request, which is annoying.
+    warnings.filterwarnings(action="ignore", message="Unverified HTTPS request")
+
+
+def _patch_requests_session():
+    from requests import Session
+
     old_init = Session.__init__
 
     def new_init(self):
@@ -42,8 +53,21 @@ def disable_ssl_verification():
 
     Session.__init__ = new_init
 
-    # Diabling SSL verification trigger InsecureRequestWarning for every request, which is annoying.
-    warnings.filterwarnings(action="ignore", category=InsecureRequestWarning)
+
+class _PatchAfterImportingRequests(importlib.abc.MetaPathFinder):
+    def find_spec(self, fullname, path, target=None):
+        if fullname != "requests":
+            return None
+        sys.meta_path.remove(self)
+        spec = importlib.util.find_spec(fullname)
+        exec_module = spec.loader.exec_module
+
+        def exec_module_and_patch(module):
+            exec_module(module)
+            _patch_requests_session()
+
+        spec.loader.exec_module = exec_module_and_patch
+        return spec
 
 
 disable_ssl_verification()
@@ -52,67 +76,156 @@ disable_ssl_verification()
 # ================================================
 # A handy context manager for upload only selected runs to LangSmith
 # ================================================
-import langchain
-from langchain.callbacks.manager import tracing_v2_enabled
 
 
 class tracing_v2_enabled_if_api_key_set:
     """
     A wrapper for users without Langhcain API Key no need to modify the tutorial code.
     Note that the toggling of enable/disable tracing is handled by `tracing_v2_enabled`, so we don't need to cope with `LANGCHAIN_TRACING_V2`.
+    Without the API key, runs are traced locally by `local_tracing_enabled` instead, and a latency summary is printed on exit.
     """
-    def __init__(self, project_name: None | str = None, client=None):
+    def __init__(self, project_name: None | str = None, client=None, local_traces_path=None):
         if os.environ.get("LANGCHAIN_API_KEY", ""):
+            from langchain.callbacks.manager import tracing_v2_enabled
+
             self.context_manager = tracing_v2_enabled(
                 project_name=project_name, client=client
             )
-            
+        else:
+            from .tracing import local_tracing_enabled
+
+            self.context_manager = local_tracing_enabled(
+                project_name=project_name, path=local_traces_path
+            )
+
     def __enter__(self):
-        if hasattr(self, "context_manager"):
-            self.cb = self.context_manager.__enter__()
-            return self.cb
+        self.cb = self.context_manager.__enter__()
+        return self.cb
 
     def __exit__(self, type, value, traceback):
-        if hasattr(self, "context_manager"):
+        self.context_manager.__exit__(type, value, traceback)
+        if hasattr(self.cb, "get_run_url"):
             print(f"[LangSmith URL]: {self.cb.get_run_url()}")
-            self.context_manager.__exit__(type, value, traceback)
+        else:
+            self.cb.print_summary()
 
 
 # ================================================
 # Automatically decide whether to use Azure API and the default model/deployment name
 # ================================================
-from langchain.chat_models import ChatOpenAI as _ChatOpenAI, AzureChatOpenAI
-from langchain.llms import OpenAI as _OpenAI, AzureOpenAI
 from functools import partial
 
-if os.environ.get("OPENAI_API_TYPE", None) == "azure":
-    OpenAI = partial(
-        AzureOpenAI, deployment_name=os.environ["DEFAULT_AZURE_OPENAI_LLM_DEPLOYMENT"]
-    )
-    ChatOpenAI = partial(
-        AzureChatOpenAI,
-        deployment_name=os.environ["DEFAULT_AZURE_OPENAI_CHAT_DEPLOYMENT"],
-    )
-else:
-    OpenAI = partial(_OpenAI, model_name=os.environ["DEFAULT_OPENAI_LLM_MODEL"])
-    ChatOpenAI = partial(
-        _ChatOpenAI, model_name=os.environ["DEFAULT_OPENAI_CHAT_MODEL"]
+
+def _create_model_factories():
+    from langchain.chat_models import ChatOpenAI as _ChatOpenAI, AzureChatOpenAI
+    from langchain.llms import OpenAI as _OpenAI, AzureOpenAI
+    from .cache import enable_llm_cache_if_configured
+    from .coalescing import with_coalescing
+    from .rate_limit import with_rate_limit
+
+    enable_llm_cache_if_configured()
+    # Rate limited inside coalescing, so that coalesced calls don't take quota.
+    _ChatOpenAI, AzureChatOpenAI, _OpenAI, AzureOpenAI = (
+        with_coalescing(with_rate_limit(cls))
+        for cls in (_ChatOpenAI, AzureChatOpenAI, _OpenAI, AzureOpenAI)
     )
 
+    if os.environ.get("OPENAI_API_TYPE", None) == "azure":
+        OpenAI = partial(
+            AzureOpenAI,
+            deployment_name=os.environ["DEFAULT_AZURE_OPENAI_LLM_DEPLOYMENT"],
+        )
+        ChatOpenAI = partial(
+            AzureChatOpenAI,
+            deployment_name=os.environ["DEFAULT_AZURE_OPENAI_CHAT_DEPLOYMENT"],
+        )
+    else:
+        OpenAI = partial(_OpenAI, model_name=os.environ["DEFAULT_OPENAI_LLM_MODEL"])
+        ChatOpenAI = partial(
+            _ChatOpenAI, model_name=os.environ["DEFAULT_OPENAI_CHAT_MODEL"]
+        )
+    return {"OpenAI": OpenAI, "ChatOpenAI": ChatOpenAI}
+
+
+# ================================================
+# Lazily resolved attributes, importing langchain only when they are used
+# ================================================
+_LAZY_QDRANT_ATTRIBUTES = (
+    "create_empty_qdrant",
+    "create_inmemory_empty_qdrant",
+    "create_persistent_qdrant",
+    "pprint_qdrant_documents",
+)
+
+
+def __getattr__(name):
+    if name in ("OpenAI", "ChatOpenAI"):
+        globals().update(_create_model_factories())
+    elif name in _LAZY_QDRANT_ATTRIBUTES:
+        from . import qdrant
+
+        globals().update(
+            {attr: getattr(qdrant, attr) for attr in _LAZY_QDRANT_ATTRIBUTES}
+        )
+    else:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    return globals()[name]
+
+
+def __dir__():
+    return [*globals(), "OpenAI", "ChatOpenAI", *_LAZY_QDRANT_ATTRIBUTES]
+
+
 # ================================================
 # Pretty print documents
 # ================================================
+from itertools import count
 from pprint import pprint, pformat
 from textwrap import dedent
-from langchain.schema import Document
+from typing import TYPE_CHECKING, Iterable
+
+if TYPE_CHECKING:
+    from langchain.schema import Document
 
 
-def pprint_document(document: Document = None, document_id=None, return_string=False):
+DOCUMENT_SEPARATOR = "-" * 100
+
+
+def pprint_document(
+    document: "Document" = None,
+    document_id=None,
+    return_string=False,
+    max_characters: None | int = None,
+    metadata_keys: None | Iterable[str] = None,
+    exclude_metadata_keys: None | Iterable[str] = None,
+    file=None,
+):
+    """Pretty print the content and the metadata of the document.
+
+    Args:
+        max_characters: Truncate the content to this many characters.
+        metadata_keys: Only print these keys of the metadata.
+        exclude_metadata_keys: Don't print these keys of the metadata.
+        file: Where to print. Default to `sys.stdout`.
+    """
+    content = document.page_content
+    if max_characters is not None and len(content) > max_characters:
+        content = (
+            f"{content[:max_characters]}... "
+            f"({len(content) - max_characters} more characters)"
+        )
+    metadata = document.metadata
+    if metadata_keys is not None:
+        metadata = {key: metadata[key] for key in metadata_keys if key in metadata}
+    if exclude_metadata_keys is not None:
+        excluded = set(exclude_metadata_keys)
+        metadata = {key: value for key, value in metadata.items() if key not in excluded}
+
     displayed_text = ""
     if document_id:
         displayed_text += f"Document {document_id}:\n\n"
-    displayed_text += f"{document.page_content}\n\n"
-    metadata_text = pformat(document.metadata, indent=1)
+    displayed_text += f"{content}\n\n"
+    metadata_text = pformat(metadata, indent=1)
     if "\n" in metadata_text:
         displayed_text += f"Metadata:\n{metadata_text}"
     else:
@@ -121,20 +234,62 @@ def pprint_document(document: Document = None, document_id=None, return_string=F
     if return_string:
         return displayed_text
     else:
-        print(displayed_text)
-
-
-def pprint_documents(documents, document_ids=None):
+        print(displayed_text, file=file, flush=True)
+
+
+def pprint_documents(
+    documents: Iterable["Document"],
+    document_ids: None | Iterable = None,
+    max_characters: None | int = None,
+    max_total_characters: None | int = None,
+    metadata_keys: None | Iterable[str] = None,
+    exclude_metadata_keys: None | Iterable[str] = None,
+    file=None,
+):
+    """Pretty print documents separated by lines, printing each one as soon as it is formatted.
+
+    Documents can be any iterable, e.g. a generator of search results, which is consumed lazily, so only one document
+    is formatted in memory at a time.
+
+    Args:
+        documents: The documents.
+        document_ids: Ids printed before the documents. Default to 1, 2, 3, ...
+        max_characters: Truncate the content of every document to this many characters.
+        max_total_characters: Stop printing, and stop consuming `documents`, after this many characters.
+        metadata_keys: Only print these keys of the metadata.
+        exclude_metadata_keys: Don't print these keys of the metadata.
+        file: Where to print. Default to `sys.stdout`.
+    """
     if not document_ids:
-        document_ids = [i + 1 for i in range(len(documents))]
+        document_ids = count(1)
+    metadata_keys = None if metadata_keys is None else list(metadata_keys)
+    exclude_metadata_keys = (
+        None if exclude_metadata_keys is None else set(exclude_metadata_keys)
+    )
 
-    displayed_texts = []
-    for document_id, document in zip(document_ids, documents):
+    total_characters = 0
+    for i, (document_id, document) in enumerate(zip(document_ids, documents)):
         displayed_text = pprint_document(
-            document_id=document_id, document=document, return_string=True
+            document_id=document_id,
+            document=document,
+            return_string=True,
+            max_characters=max_characters,
+            metadata_keys=metadata_keys,
+            exclude_metadata_keys=exclude_metadata_keys,
         )
-        displayed_texts.append(displayed_text)
-    print(f"\n{'-' * 100}\n".join(displayed_texts))
+        if max_total_characters is not None:
+            remaining_characters = max_total_characters - total_characters
+            if len(displayed_text) > remaining_characters:
+                displayed_text = (
+                    f"{displayed_text[:remaining_characters]}... "
+                    f"(stopped after {max_total_characters} characters)"
+                )
+            total_characters += len(displayed_text)
+        if i > 0:
+            print(DOCUMENT_SEPARATOR, file=file)
+        print(displayed_text, file=file, flush=True)
+        if max_total_characters is not None and total_characters >= max_total_characters:
+            break
 
 
 # ================================================
@@ -0,0 +1,211 @@
+"""Persistent LLM response cache in SQLite."""
+import hashlib, logging, os, sqlite3, threading, time
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from langchain.load.dump import dumps
+from langchain.load.load import loads
+from langchain.schema.cache import RETURN_VAL_TYPE, BaseCache
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = Path("~/.cache/langchain_setup").expanduser()
+
+
+class SQLiteDatabase:
+    """SQLite database shared by threads and processes.
+
+    Each thread gets its own connection, and the database is in WAL mode so that readers don't block the writer.
+    Concurrent writers of other processes wait for `timeout` seconds instead of failing at once.
+    """
+
+    def __init__(self, database_path, schema: str, timeout: float = 30):
+        self.database_path = Path(database_path).expanduser()
+        self.database_path.parent.mkdir(parents=True, exist_ok=True)
+        self.timeout = timeout
+        self._local = threading.local()
+        with self.connection as connection:
+            connection.executescript(schema)
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        if not hasattr(self._local, "connection"):
+            connection = sqlite3.connect(
+                self.database_path, timeout=self.timeout, isolation_level=None
+            )
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return self._local.connection
+
+
+class SQLiteLLMCache(BaseCache):
+    """LLM cache persisted in SQLite, which can be safely shared by threads and processes.
+
+    Entries are keyed on the prompt and the llm string, which langchain makes from the identifying parameters of
+    the model (e.g. `TextGen._identifying_params`, the model or deployment name of `ChatOpenAI`) and the stop words.
+
+    Example:
+        .. code-block:: python
+
+            from langchain.globals import set_llm_cache
+            from langchain_setup.cache import SQLiteLLMCache
+
+            set_llm_cache(SQLiteLLMCache(max_entries=10000, max_age=7 * 24 * 3600))
+    """
+
+    def __init__(
+        self,
+        database_path=DEFAULT_CACHE_DIR / "llm_cache.db",
+        max_entries: Optional[int] = 100_000,
+        max_age: Optional[float] = None,
+        eviction_interval: int = 100,
+    ):
+        """
+        Args:
+            database_path: Path of the SQLite database file.
+            max_entries: Maximum number of entries. Least recently used entries beyond it are evicted.
+            max_age: Seconds after which an entry expires. None means never.
+            eviction_interval: Evict every `eviction_interval` updates of this process.
+        """
+        self.database = SQLiteDatabase(
+            database_path,
+            schema="""
+            CREATE TABLE IF NOT EXISTS llm_cache (
+                key TEXT PRIMARY KEY,
+                prompt TEXT,
+                llm_string TEXT,
+                generations TEXT,
+                created_at REAL,
+                accessed_at REAL
+            );
+            CREATE INDEX IF NOT EXISTS llm_cache_accessed_at ON llm_cache (accessed_at);
+            CREATE INDEX IF NOT EXISTS llm_cache_created_at ON llm_cache (created_at);
+            """,
+        )
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.eviction_interval = eviction_interval
+        self.hits = 0
+        self.misses = 0
+        self._updates = 0
+        self._lock = threading.Lock()
+
+    def lookup(self, prompt: str, llm_string: str) -> Optional[RETURN_VAL_TYPE]:
+        """Look up based on prompt and llm_string."""
+        key = _hash(prompt, llm_string)
+        row = self.database.connection.execute(
+            "SELECT generations, created_at FROM llm_cache WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None or (self.max_age and time.time() - row[1] > self.max_age):
+            with self._lock:
+                self.misses += 1
+            return None
+
+        self.database.connection.execute(
+            "UPDATE llm_cache SET accessed_at = ? WHERE key = ?", (time.time(), key)
+        )
+        with self._lock:
+            self.hits += 1
+        return loads(row[0])
+
+    def update(self, prompt: str, llm_string: str, return_val: RETURN_VAL_TYPE) -> None:
+        """Update cache based on prompt and llm_string."""
+        if is_failed_generation(return_val):
+            return
+
+        now = time.time()
+        self.database.connection.execute(
+            "INSERT OR REPLACE INTO llm_cache VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                _hash(prompt, llm_string),
+                prompt,
+                llm_string,
+                dumps(list(return_val)),
+                now,
+                now,
+            ),
+        )
+        with self._lock:
+            self._updates += 1
+            evict = self._updates % self.eviction_interval == 0
+        if evict:
+            self.evict()
+
+    def evict(self):
+        """Delete expired entries and least recently used entries beyond `max_entries`."""
+        connection = self.database.connection
+        if self.max_age:
+            connection.execute(
+                "DELETE FROM llm_cache WHERE created_at < ?",
+                (time.time() - self.max_age,),
+            )
+        if self.max_entries:
+            connection.execute(
+                """
+                DELETE FROM llm_cache WHERE key IN (
+                    SELECT key FROM llm_cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?
+                )
+                """,
+                (self.max_entries,),
+            )
+
+    def clear(self, **kwargs: Any) -> None:
+        """Clear cache."""
+        self.database.connection.execute("DELETE FROM llm_cache")
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters of this process, and the number of entries in the database."""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else None,
+            "entries": self.database.connection.execute(
+                "SELECT COUNT(*) FROM llm_cache"
+            ).fetchone()[0],
+        }
+
+
+def is_failed_generation(return_val: RETURN_VAL_TYPE) -> bool:
+    """Whether the generations are of a failed prompt, which caches should not store, see `TextGen._generate`."""
+    return any((gen.generation_info or {}).get("error") for gen in return_val)
+
+
+def _hash(prompt: str, llm_string: str) -> str:
+    return hashlib.sha256(f"{llm_string}\0{prompt}".encode()).hexdigest()
+
+
+def enable_llm_cache(**kwargs) -> SQLiteLLMCache:
+    """Install `SQLiteLLMCache` as the global LLM cache used by all models, and return it."""
+    from langchain.globals import get_llm_cache, set_llm_cache
+
+    if not isinstance(get_llm_cache(), SQLiteLLMCache):
+        set_llm_cache(SQLiteLLMCache(**kwargs))
+        logger.info(f"LLM cache {get_llm_cache().database.database_path} is enabled.")
+    return get_llm_cache()
+
+
+def enable_llm_cache_if_configured() -> Optional[BaseCache]:
+    """Enable the LLM cache if environment variable `LLM_CACHE_PATH` or `LLM_SEMANTIC_CACHE_PATH` is set.
+
+    `LLM_SEMANTIC_CACHE_PATH` enables `SemanticLLMCache` persisted in that folder, with the similarity threshold
+    `LLM_SEMANTIC_CACHE_THRESHOLD` if it is set, and takes precedence over `LLM_CACHE_PATH`.
+    `LLM_CACHE_MAX_ENTRIES` and `LLM_CACHE_MAX_AGE` (in seconds) are also read if they are set.
+    """
+    max_age = None
+    if os.environ.get("LLM_CACHE_MAX_AGE"):
+        max_age = float(os.environ["LLM_CACHE_MAX_AGE"])
+    if os.environ.get("LLM_SEMANTIC_CACHE_PATH"):
+        from .semantic_cache import enable_semantic_llm_cache
+
+        kwargs = {"path": os.environ["LLM_SEMANTIC_CACHE_PATH"], "max_age": max_age}
+        if os.environ.get("LLM_SEMANTIC_CACHE_THRESHOLD"):
+            kwargs["score_threshold"] = float(os.environ["LLM_SEMANTIC_CACHE_THRESHOLD"])
+        return enable_semantic_llm_cache(**kwargs)
+    if not os.environ.get("LLM_CACHE_PATH"):
+        return None
+    kwargs = {"database_path": os.environ["LLM_CACHE_PATH"], "max_age": max_age}
+    if os.environ.get("LLM_CACHE_MAX_ENTRIES"):
+        kwargs["max_entries"] = int(os.environ["LLM_CACHE_MAX_ENTRIES"])
+    return enable_llm_cache(**kwargs)
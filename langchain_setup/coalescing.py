@@ -0,0 +1,172 @@
+"""Coalesce identical in-flight requests of deterministic generations into one."""
+import asyncio, json, threading
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+from langchain.load.dump import dumps
+
+DETERMINISTIC_TEMPERATURE = 1e-2
+"""Generations with temperature not greater than this are regarded as deterministic."""
+
+
+class SingleFlight:
+    """Let concurrent calls with the same key share the result of the first one, which is the only one really run.
+
+    Example:
+        .. code-block:: python
+
+            single_flight = SingleFlight()
+            # Called concurrently by many threads, `generate` runs only once for the same prompt.
+            single_flight.do(prompt, lambda: generate(prompt))
+    """
+
+    def __init__(self):
+        self._calls: Dict[Hashable, "_Call"] = {}
+        self._async_calls: Dict[Hashable, "_AsyncCall"] = {}
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.coalesced = 0
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.calls += 1
+            else:
+                self.coalesced += 1
+
+        if leader:
+            try:
+                call.result = fn()
+            except BaseException as e:
+                call.error = e
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+        else:
+            call.done.wait()
+
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    async def ado(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """Async version of `do`. Only calls in the same event loop are coalesced.
+
+        The call runs as its own task, which every caller awaits through `asyncio.shield`, so a caller cancelled,
+        e.g. by `asyncio.wait_for`, doesn't cancel the call for the others. It is cancelled only when all callers are.
+        """
+        key = (id(asyncio.get_running_loop()), key)
+        with self._lock:
+            call = self._async_calls.get(key)
+            if call is None:
+                call = self._async_calls[key] = _AsyncCall(asyncio.ensure_future(fn()))
+                call.task.add_done_callback(lambda task: self._remove_async_call(key, call))
+                self.calls += 1
+            else:
+                self.coalesced += 1
+            call.waiters += 1
+
+        try:
+            return await asyncio.shield(call.task)
+        except asyncio.CancelledError:
+            if not call.task.done():
+                with self._lock:
+                    call.waiters -= 1
+                    if call.waiters == 0:
+                        call.task.cancel()
+            raise
+
+    def _remove_async_call(self, key: Hashable, call: "_AsyncCall"):
+        # Mark the exception as retrieved, so it isn't logged when all callers were cancelled.
+        call.task.cancelled() or call.task.exception()
+        with self._lock:
+            if self._async_calls.get(key) is call:
+                del self._async_calls[key]
+
+    def stats(self) -> Dict[str, Any]:
+        """Number of calls really run, and number of calls which shared the result of another call."""
+        total = self.calls + self.coalesced
+        return {
+            "calls": self.calls,
+            "coalesced": self.coalesced,
+            "coalesced_rate": self.coalesced / total if total else None,
+        }
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class _AsyncCall:
+    def __init__(self, task: asyncio.Future):
+        self.task = task
+        self.waiters = 0
+
+
+single_flight = SingleFlight()
+"""Shared by all models in the process, so that identical requests of different instances are also coalesced."""
+
+
+def is_deterministic(temperature: Optional[float], do_sample: bool = True) -> bool:
+    return not do_sample or (
+        temperature is not None and temperature <= DETERMINISTIC_TEMPERATURE
+    )
+
+
+class CoalescingMixin:
+    """Mix into a langchain LLM or chat model class to coalesce identical in-flight generations.
+
+    Only deterministic and non-streaming generations are coalesced, because other concurrent callers would get
+    a result different from what they might have, or miss the tokens streamed to the callbacks of the first caller.
+    """
+
+    def _coalescing_key(self, inputs, stop, kwargs) -> Optional[str]:
+        temperature = kwargs.get("temperature", getattr(self, "temperature", None))
+        if getattr(self, "streaming", False) or not is_deterministic(temperature):
+            return None
+        return json.dumps(
+            [
+                type(self).__name__,
+                self._identifying_params,
+                dumps(inputs),
+                stop,
+                kwargs,
+            ],
+            sort_keys=True,
+            default=str,
+        )
+
+    def _generate(self, inputs, stop=None, run_manager=None, **kwargs):
+        key = self._coalescing_key(inputs, stop, kwargs)
+        if key is None:
+            return super()._generate(inputs, stop=stop, run_manager=run_manager, **kwargs)
+        return single_flight.do(
+            key,
+            lambda: super(CoalescingMixin, self)._generate(
+                inputs, stop=stop, run_manager=run_manager, **kwargs
+            ),
+        )
+
+    async def _agenerate(self, inputs, stop=None, run_manager=None, **kwargs):
+        key = self._coalescing_key(inputs, stop, kwargs)
+        if key is None:
+            return await super()._agenerate(
+                inputs, stop=stop, run_manager=run_manager, **kwargs
+            )
+        return await single_flight.ado(
+            key,
+            lambda: super(CoalescingMixin, self)._agenerate(
+                inputs, stop=stop, run_manager=run_manager, **kwargs
+            ),
+        )
+
+
+def with_coalescing(cls):
+    """Create a subclass of the langchain model class `cls` with `CoalescingMixin`, keeping its name and module."""
+    return type(cls.__name__, (CoalescingMixin, cls), {"__module__": cls.__module__})
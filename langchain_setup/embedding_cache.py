@@ -0,0 +1,214 @@
+"""Persistent content-addressed embedding cache in SQLite."""
+import hashlib, json, logging, math, threading, time
+from array import array
+from typing import Any, Dict, List, Optional
+
+from langchain.schema.embeddings import Embeddings
+
+from .cache import DEFAULT_CACHE_DIR, SQLiteDatabase
+
+logger = logging.getLogger(__name__)
+
+# SQLite limits the number of host parameters of a statement.
+LOOKUP_BATCH_SIZE = 500
+DEFAULT_MAX_BYTES = 2**30
+"""The cache is on by default in `create_empty_qdrant`, so it is kept under 1 GiB unless asked otherwise."""
+
+
+class CachedEmbeddings(Embeddings):
+    """Embedder wrapped with a cache persisted in SQLite, keyed on (embedding model, hash of text).
+
+    Vectors are stored as float32 blobs. Texts already embedded by the same model, in this process or any other
+    process sharing the database, are not sent to the embedder again.
+
+    Example:
+        .. code-block:: python
+
+            from langchain.embeddings import OpenAIEmbeddings
+            from langchain_setup.embedding_cache import CachedEmbeddings
+
+            embedding = CachedEmbeddings(OpenAIEmbeddings())
+            embedding.embed_documents(texts)  # Only texts not embedded before are sent to OpenAI
+            print(embedding.stats())
+    """
+
+    def __init__(
+        self,
+        embedding: Embeddings,
+        database_path=DEFAULT_CACHE_DIR / "embedding_cache.db",
+        max_entries: Optional[int] = 1_000_000,
+        max_bytes: Optional[int] = DEFAULT_MAX_BYTES,
+        eviction_interval: int = 10_000,
+    ):
+        """
+        Args:
+            embedding: The embedder to be cached.
+            database_path: Path of the SQLite database file.
+            max_entries: Maximum number of vectors. Least recently used vectors beyond it are evicted.
+            max_bytes: Maximum total bytes of vectors. Least recently used vectors beyond it are evicted. Default to
+                1 GiB.
+            eviction_interval: Evict every time this process has inserted `eviction_interval` vectors.
+        """
+        self.embedding = embedding
+        self.namespace = embedding_identity(embedding)
+        self.database = SQLiteDatabase(
+            database_path,
+            schema="""
+            CREATE TABLE IF NOT EXISTS embedding_cache (
+                key TEXT PRIMARY KEY,
+                vector BLOB,
+                accessed_at REAL
+            );
+            CREATE INDEX IF NOT EXISTS embedding_cache_accessed_at ON embedding_cache (accessed_at);
+            """,
+        )
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.eviction_interval = eviction_interval
+        self.hits = 0
+        self.misses = 0
+        self._inserts_since_eviction = 0
+        self._lock = threading.Lock()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Embed search docs."""
+        keys = [self._key(text) for text in texts]
+        vectors = self._lookup(set(keys))
+
+        missing = {key: text for key, text in zip(keys, texts) if key not in vectors}
+        if missing:
+            new_vectors = self.embedding.embed_documents(list(missing.values()))
+            vectors.update(zip(missing.keys(), new_vectors))
+            self._insert(dict(zip(missing.keys(), new_vectors)))
+
+        with self._lock:
+            self.hits += len(texts) - len(missing)
+            self.misses += len(missing)
+        return [vectors[key] for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        """Embed query text."""
+        key = self._key(text)
+        vector = self._lookup({key}).get(key)
+        hit = vector is not None
+        if not hit:
+            vector = self.embedding.embed_query(text)
+            self._insert({key: vector})
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return vector
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters of this process, and the number and bytes of vectors in the database."""
+        lookups = self.hits + self.misses
+        entries, total_bytes = self.database.connection.execute(
+            "SELECT COUNT(*), COALESCE(SUM(LENGTH(vector)), 0) FROM embedding_cache"
+        ).fetchone()
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else None,
+            "entries": entries,
+            "bytes": total_bytes,
+        }
+
+    def evict(self):
+        """Delete least recently used vectors beyond `max_entries` or `max_bytes`."""
+        connection = self.database.connection
+        entries, total_bytes = connection.execute(
+            "SELECT COUNT(*), COALESCE(SUM(LENGTH(vector)), 0) FROM embedding_cache"
+        ).fetchone()
+        excess = 0
+        if self.max_entries and entries > self.max_entries:
+            excess = entries - self.max_entries
+        if self.max_bytes and total_bytes > self.max_bytes:
+            average_bytes = total_bytes / entries
+            excess = max(
+                excess, math.ceil((total_bytes - self.max_bytes) / average_bytes)
+            )
+        if excess:
+            connection.execute(
+                """
+                DELETE FROM embedding_cache WHERE key IN (
+                    SELECT key FROM embedding_cache ORDER BY accessed_at LIMIT ?
+                )
+                """,
+                (excess,),
+            )
+
+    def clear(self):
+        self.database.connection.execute("DELETE FROM embedding_cache")
+
+    def _key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.namespace}\0{text}".encode()).hexdigest()
+
+    def _lookup(self, keys) -> Dict[str, List[float]]:
+        keys = list(keys)
+        connection = self.database.connection
+        vectors = {}
+        for i in range(0, len(keys), LOOKUP_BATCH_SIZE):
+            batch = keys[i : i + LOOKUP_BATCH_SIZE]
+            placeholders = ",".join("?" * len(batch))
+            rows = connection.execute(
+                f"SELECT key, vector FROM embedding_cache WHERE key IN ({placeholders})",
+                batch,
+            ).fetchall()
+            for key, blob in rows:
+                vector = array("f")
+                vector.frombytes(blob)
+                vectors[key] = vector.tolist()
+        if vectors:
+            now = time.time()
+            with connection:
+                connection.execute("BEGIN")
+                connection.executemany(
+                    "UPDATE embedding_cache SET accessed_at = ? WHERE key = ?",
+                    [(now, key) for key in vectors],
+                )
+        return vectors
+
+    def _insert(self, vectors: Dict[str, List[float]]):
+        now = time.time()
+        connection = self.database.connection
+        with connection:
+            connection.execute("BEGIN")
+            connection.executemany(
+                "INSERT OR REPLACE INTO embedding_cache VALUES (?, ?, ?)",
+                [
+                    (key, array("f", vector).tobytes(), now)
+                    for key, vector in vectors.items()
+                ],
+            )
+        with self._lock:
+            self._inserts_since_eviction += len(vectors)
+            evict = self._inserts_since_eviction >= self.eviction_interval
+            if evict:
+                self._inserts_since_eviction = 0
+        if evict:
+            self.evict()
+
+
+def embedding_identity(embedding: Embeddings) -> str:
+    """Identify the embedding model of the embedder, so that vectors of different models are not mixed up."""
+    if isinstance(embedding, CachedEmbeddings):
+        return embedding.namespace
+    attributes = {
+        name: getattr(embedding, name)
+        for name in (
+            "model",
+            "model_name",
+            "model_id",
+            "deployment",
+            "repo_id",
+            "size",
+            "dimensions",
+        )
+        if isinstance(getattr(embedding, name, None), (str, int))
+    }
+    return json.dumps(
+        [f"{type(embedding).__module__}.{type(embedding).__name__}", attributes],
+        sort_keys=True,
+    )
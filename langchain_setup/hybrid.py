@@ -0,0 +1,283 @@
+"""Hybrid lexical (BM25) and semantic (Qdrant) retrieval, with BM25 scored by sparse matrix products."""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+from langchain.callbacks.manager import CallbackManagerForRetrieverRun
+from langchain.pydantic_v1 import Field, PrivateAttr
+from langchain.retrievers.bm25 import default_preprocessing_func
+from langchain.schema import BaseRetriever, Document
+from langchain.vectorstores import Qdrant
+
+
+class BM25Index:
+    """Okapi BM25 index of documents, which can be added incrementally.
+
+    Scores are the same as `rank_bm25.BM25Okapi` used by `langchain.retrievers.BM25Retriever`, but term frequencies
+    are kept in a sparse matrix, and a query is scored by one sparse matrix-vector product over the columns of its
+    terms instead of a Python loop over every document.
+    """
+
+    def __init__(
+        self,
+        preprocess_func: Callable[[str], List[str]] = default_preprocessing_func,
+        k1: float = 1.5,
+        b: float = 0.75,
+        epsilon: float = 0.25,
+    ):
+        """
+        Args:
+            preprocess_func: Split a text into terms.
+            k1, b, epsilon: Parameters of BM25Okapi.
+        """
+        self.preprocess_func = preprocess_func
+        self.k1 = k1
+        self.b = b
+        self.epsilon = epsilon
+        self.documents: List[Document] = []
+        self.vocabulary: Dict[str, int] = {}
+        self._rows: List[np.ndarray] = []
+        self._columns: List[np.ndarray] = []
+        self._frequencies: List[np.ndarray] = []
+        self._document_lengths: List[int] = []
+        self._weights = None  # BM25 weights of (document, term), rebuilt lazily after adds
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self.documents)
+
+    def add_documents(self, documents: Iterable[Document]):
+        """Add documents. Only term frequencies of the new documents are computed, and weights are rebuilt in a
+        vectorized way at the next search, because adding documents changes idf and average length of all."""
+        with self._lock:
+            for document in documents:
+                row = len(self.documents)
+                counts: Dict[int, int] = {}
+                terms = self.preprocess_func(document.page_content)
+                for term in terms:
+                    column = self.vocabulary.setdefault(term, len(self.vocabulary))
+                    counts[column] = counts.get(column, 0) + 1
+                self.documents.append(document)
+                self._document_lengths.append(len(terms))
+                self._rows.append(np.full(len(counts), row, dtype=np.int32))
+                self._columns.append(np.fromiter(counts.keys(), np.int32, len(counts)))
+                self._frequencies.append(
+                    np.fromiter(counts.values(), np.float32, len(counts))
+                )
+            self._weights = None
+
+    def get_scores(self, query: str) -> np.ndarray:
+        """BM25 scores of all documents for the query."""
+        with self._lock:
+            weights = self._get_weights()
+            query_counts: Dict[int, int] = {}
+            for term in self.preprocess_func(query):
+                if term in self.vocabulary:
+                    column = self.vocabulary[term]
+                    query_counts[column] = query_counts.get(column, 0) + 1
+        if not query_counts:
+            return np.zeros(weights.shape[0], dtype=np.float32)
+        columns = np.fromiter(query_counts.keys(), np.int32, len(query_counts))
+        counts = np.fromiter(query_counts.values(), np.float32, len(query_counts))
+        return weights[:, columns] @ counts
+
+    def search(self, query: str, k: int = 4) -> List[Document]:
+        """Top `k` documents in descending order of score, including documents of zero score if there are not
+        enough matches, like `BM25Okapi.get_top_n`.
+
+        Documents of the same score are ordered from the last added. `BM25Okapi.get_top_n` orders them by an unstable
+        sort, which does the same for small corpora, so only the order of ties may differ from it.
+        """
+        scores = self.get_scores(query)
+        k = min(k, len(scores))
+        if k == 0:
+            return []
+        threshold = np.partition(scores, len(scores) - k)[len(scores) - k]
+        above = np.flatnonzero(scores > threshold)
+        ties = np.flatnonzero(scores == threshold)[::-1][: k - len(above)]
+        top = np.concatenate([above, ties])
+        top = top[np.lexsort((-top, -scores[top]))]
+        return [self.documents[i] for i in top]
+
+    def _get_weights(self):
+        from scipy import sparse
+
+        if self._weights is not None:
+            return self._weights
+        n_documents, n_terms = len(self.documents), len(self.vocabulary)
+        if not n_documents:
+            self._weights = sparse.csc_matrix((0, 0), dtype=np.float32)
+            return self._weights
+        self._rows = [np.concatenate(self._rows)]
+        self._columns = [np.concatenate(self._columns)]
+        self._frequencies = [np.concatenate(self._frequencies)]
+        rows, columns, frequencies = self._rows[0], self._columns[0], self._frequencies[0]
+
+        document_frequencies = np.bincount(columns, minlength=n_terms)
+        idf = np.log(n_documents - document_frequencies + 0.5) - np.log(
+            document_frequencies + 0.5
+        )
+        # Same as BM25Okapi, floor the idf of terms in more than half of documents.
+        idf[idf < 0] = self.epsilon * idf.mean()
+
+        document_lengths = np.asarray(self._document_lengths, dtype=np.float32)
+        average_length = document_lengths.mean() or 1.0
+        normalizers = self.k1 * (1 - self.b + self.b * document_lengths / average_length)
+        weights = (
+            idf[columns]
+            * frequencies
+            * (self.k1 + 1)
+            / (frequencies + normalizers[rows])
+        ).astype(np.float32)
+        self._weights = sparse.csc_matrix(
+            (weights, (rows, columns)), shape=(n_documents, n_terms)
+        )
+        return self._weights
+
+
+class BM25SparseRetriever(BaseRetriever):
+    """Replacement of `langchain.retrievers.BM25Retriever` backed by `BM25Index`, returning the same top `k`
+    documents except for the order of documents of the same score, see `BM25Index.search`.
+
+    Example:
+        .. code-block:: python
+
+            retriever = BM25SparseRetriever.from_documents(documents, k=4)
+            retriever.add_documents(new_documents)
+            retriever.get_relevant_documents("query")
+    """
+
+    index: BM25Index
+    k: int = 4
+    """Number of documents to return."""
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    @classmethod
+    def from_texts(
+        cls,
+        texts: Iterable[str],
+        metadatas: Optional[Iterable[dict]] = None,
+        bm25_params: Optional[Dict[str, Any]] = None,
+        preprocess_func: Callable[[str], List[str]] = default_preprocessing_func,
+        **kwargs: Any,
+    ) -> "BM25SparseRetriever":
+        metadatas = metadatas or ({} for _ in texts)
+        return cls.from_documents(
+            (Document(page_content=t, metadata=m) for t, m in zip(texts, metadatas)),
+            bm25_params=bm25_params,
+            preprocess_func=preprocess_func,
+            **kwargs,
+        )
+
+    @classmethod
+    def from_documents(
+        cls,
+        documents: Iterable[Document],
+        *,
+        bm25_params: Optional[Dict[str, Any]] = None,
+        preprocess_func: Callable[[str], List[str]] = default_preprocessing_func,
+        **kwargs: Any,
+    ) -> "BM25SparseRetriever":
+        index = BM25Index(preprocess_func=preprocess_func, **(bm25_params or {}))
+        index.add_documents(documents)
+        return cls(index=index, **kwargs)
+
+    def add_documents(self, documents: Iterable[Document]):
+        self.index.add_documents(documents)
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        return self.index.search(query, k=self.k)
+
+
+class HybridRetriever(BaseRetriever):
+    """Retrieve by BM25 and by the Qdrant vector store at the same time, and fuse both rankings by weighted
+    reciprocal rank fusion, in the same way as `EnsembleRetriever`.
+
+    Example:
+        .. code-block:: python
+
+            retriever = HybridRetriever.from_vectorstore(create_persistent_qdrant("notion"), k=4)
+            retriever.add_documents(new_documents)  # Added to both Qdrant and the BM25 index
+            retriever.get_relevant_documents("query")
+    """
+
+    vectorstore: Qdrant
+    bm25: BM25Index
+    k: int = 4
+    """Number of documents to return."""
+    fetch_k: int = 20
+    """Number of documents retrieved by each of BM25 and the vector store before fusion."""
+    weights: Sequence[float] = (0.5, 0.5)
+    """Weights of the BM25 ranking and the vector store ranking."""
+    c: int = 60
+    """Constant added to ranks, which controls the balance between top and lower ranked documents."""
+    search_kwargs: Dict[str, Any] = Field(default_factory=dict)
+    """Other arguments of `Qdrant.similarity_search`, e.g. `filter`."""
+    _executor: ThreadPoolExecutor = PrivateAttr(
+        default_factory=lambda: ThreadPoolExecutor(4, thread_name_prefix="hybrid")
+    )
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    @classmethod
+    def from_vectorstore(
+        cls,
+        vectorstore: Qdrant,
+        bm25_params: Optional[Dict[str, Any]] = None,
+        preprocess_func: Callable[[str], List[str]] = default_preprocessing_func,
+        **kwargs: Any,
+    ) -> "HybridRetriever":
+        """Create the retriever with the BM25 index built from documents already in the collection."""
+        from .qdrant import iter_qdrant_documents
+
+        bm25 = BM25Index(preprocess_func=preprocess_func, **(bm25_params or {}))
+        bm25.add_documents(
+            document for _, document in iter_qdrant_documents(vectorstore, page_size=1000)
+        )
+        return cls(vectorstore=vectorstore, bm25=bm25, **kwargs)
+
+    def add_documents(self, documents: List[Document], **kwargs) -> List[str]:
+        """Add documents to both the vector store and the BM25 index."""
+        ids = self.vectorstore.add_documents(documents, **kwargs)
+        self.bm25.add_documents(documents)
+        return ids
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        # Qdrant waits for the embedder and the server, so BM25 is scored meanwhile.
+        vector_future = self._executor.submit(
+            self.vectorstore.similarity_search,
+            query,
+            k=self.fetch_k,
+            **self.search_kwargs,
+        )
+        lexical_documents = self.bm25.search(query, k=self.fetch_k)
+        return reciprocal_rank_fusion(
+            [lexical_documents, vector_future.result()], self.weights, self.c
+        )[: self.k]
+
+
+def reciprocal_rank_fusion(
+    document_lists: List[List[Document]], weights: Sequence[float], c: int = 60
+) -> List[Document]:
+    """Weighted reciprocal rank fusion of rankings, identifying documents by their content like `EnsembleRetriever`."""
+    if len(document_lists) != len(weights):
+        raise ValueError("Number of rank lists must be equal to the number of weights.")
+    scores: Dict[str, float] = {}
+    documents: Dict[str, Document] = {}
+    for document_list, weight in zip(document_lists, weights):
+        for rank, document in enumerate(document_list, start=1):
+            content = document.page_content
+            scores[content] = scores.get(content, 0.0) + weight / (rank + c)
+            documents.setdefault(content, document)
+    return [
+        documents[content]
+        for content in sorted(scores, key=scores.__getitem__, reverse=True)
+    ]
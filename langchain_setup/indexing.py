@@ -0,0 +1,269 @@
+"""Incremental, hash-based re-indexing of documents into Qdrant."""
+import hashlib, json, logging, time, uuid
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, Iterable, Iterator, List, Literal, Optional, Tuple
+
+from langchain.schema import Document
+from langchain.text_splitter import TextSplitter
+from langchain.vectorstores import Qdrant
+
+from .cache import DEFAULT_CACHE_DIR, SQLiteDatabase
+from .ingestion import IngestionStats, embed_and_upsert
+
+logger = logging.getLogger(__name__)
+
+DELETE_BATCH_SIZE = 1000
+_POINT_ID_NAMESPACE = uuid.UUID("6f1c1d2e-8a4b-4c1e-9d3a-2b5e7f0a9c11")
+
+
+@dataclass
+class SyncResult:
+    documents: int = 0
+    added: int = 0
+    """Number of new or changed chunks embedded and upserted."""
+    unchanged: int = 0
+    """Number of chunks skipped because they are already in the collection."""
+    deleted: int = 0
+    """Number of orphan chunks deleted."""
+    seconds: float = 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+class QdrantIndex:
+    """Local record of the chunks in Qdrant collections: document id -> chunk hash -> point id.
+
+    Collections are identified by `collection_key`, i.e. the location of the Qdrant and the collection name, so
+    collections of the same name in different Qdrants don't share records.
+    """
+
+    def __init__(self, database_path=DEFAULT_CACHE_DIR / "qdrant_index.db"):
+        self.database = SQLiteDatabase(
+            database_path,
+            schema="""
+            CREATE TABLE IF NOT EXISTS qdrant_index (
+                collection TEXT,
+                point_id TEXT,
+                document_id TEXT,
+                chunk_hash TEXT,
+                PRIMARY KEY (collection, point_id)
+            );
+            CREATE INDEX IF NOT EXISTS qdrant_index_document
+                ON qdrant_index (collection, document_id);
+            """,
+        )
+
+    def contains(self, collection: str, point_id: str) -> bool:
+        return (
+            self.database.connection.execute(
+                "SELECT 1 FROM qdrant_index WHERE collection = ? AND point_id = ?",
+                (collection, point_id),
+            ).fetchone()
+            is not None
+        )
+
+    def point_ids(self, collection: str) -> Iterator[Tuple[str, str]]:
+        """Yield (point id, document id) of all the chunks of the collection."""
+        yield from self.database.connection.execute(
+            "SELECT point_id, document_id FROM qdrant_index WHERE collection = ?",
+            (collection,),
+        )
+
+    def add(self, collection: str, records: List[Tuple[str, str, str]]):
+        """Add (point id, document id, chunk hash) records."""
+        connection = self.database.connection
+        with connection:
+            connection.execute("BEGIN")
+            connection.executemany(
+                "INSERT OR REPLACE INTO qdrant_index VALUES (?, ?, ?, ?)",
+                [(collection, *record) for record in records],
+            )
+
+    def clear(self, collection: str):
+        connection = self.database.connection
+        with connection:
+            connection.execute("BEGIN")
+            connection.execute(
+                "DELETE FROM qdrant_index WHERE collection = ?", (collection,)
+            )
+
+    def delete(self, collection: str, point_ids: List[str]):
+        connection = self.database.connection
+        with connection:
+            connection.execute("BEGIN")
+            connection.executemany(
+                "DELETE FROM qdrant_index WHERE collection = ? AND point_id = ?",
+                [(collection, point_id) for point_id in point_ids],
+            )
+
+
+def sync_qdrant(
+    vectorstore: Qdrant,
+    documents: Iterable[Document],
+    text_splitter: Optional[TextSplitter] = None,
+    source_id_key: str = "source",
+    cleanup: Literal["incremental", "full"] = "incremental",
+    index: Optional[QdrantIndex] = None,
+    batch_size: int = 64,
+    embed_concurrency: int = 4,
+    upsert_concurrency: int = 2,
+) -> SyncResult:
+    """Sync documents into the Qdrant collection, embedding and upserting only new or changed chunks.
+
+    Chunks are identified by the hash of their content and metadata, and their point ids are derived from it, so
+    a chunk already in the collection is skipped. Chunks in the collection no longer produced by their document are
+    deleted in bulk.
+
+    The local index only narrows down which chunks may be skipped: they are looked up in the collection in batches,
+    and embedded again if missing, e.g. when an in-memory collection of the same name was created again. The index of
+    an empty collection is rebuilt from scratch.
+
+    Args:
+        vectorstore: The Qdrant vector store.
+        documents: Any iterable of documents, e.g. `NotionDirectoryLoader(path).lazy_load()`.
+        text_splitter: Split documents into chunks with it if given.
+        source_id_key: Key of the metadata identifying which document a chunk is from.
+        cleanup: "incremental" deletes orphan chunks of the documents synced this time. "full" also deletes chunks of
+            documents not synced this time, which should be used when `documents` is the whole corpus.
+        index: The local record of chunks in the collection. Default to the one in `~/.cache/langchain_setup`.
+        batch_size, embed_concurrency, upsert_concurrency: See `ingest_documents`.
+
+    Returns:
+        Number of documents synced, and chunks added, unchanged and deleted.
+
+    Example:
+        .. code-block:: python
+
+            result = sync_qdrant(
+                vectorstore,
+                NotionDirectoryLoader("data/notion").lazy_load(),
+                text_splitter=RecursiveCharacterTextSplitter(chunk_size=500),
+                cleanup="full",
+            )
+            print(result)
+    """
+    if cleanup not in ("incremental", "full"):
+        raise ValueError(f"`cleanup` should be 'incremental' or 'full', got {cleanup}.")
+    index = index or QdrantIndex()
+    collection = collection_key(vectorstore)
+    if _count_points(vectorstore) == 0:
+        index.clear(collection)
+    result = SyncResult()
+    start_time = time.time()
+
+    synced_document_ids = set()
+    current_point_ids = set()
+    new_records: List[Tuple[str, str, str]] = []
+
+    def check_indexed(indexed) -> Iterator[Tuple[str, Document]]:
+        """Skip indexed chunks still in the collection, and yield those missing from it."""
+        existing_point_ids = _existing_point_ids(
+            vectorstore, [record[0] for record, _ in indexed]
+        )
+        for record, chunk in indexed:
+            if record[0] in existing_point_ids:
+                result.unchanged += 1
+            else:
+                new_records.append(record)
+                yield record[0], chunk
+
+    def new_chunks() -> Iterator[Tuple[str, Document]]:
+        indexed: List[Tuple[Tuple[str, str, str], Document]] = []
+        for document in documents:
+            result.documents += 1
+            if source_id_key not in document.metadata:
+                raise ValueError(
+                    f"Metadata of document should have `{source_id_key}` "
+                    f"to identify it: {document.metadata}"
+                )
+            document_id = str(document.metadata[source_id_key])
+            synced_document_ids.add(document_id)
+            if text_splitter:
+                chunks = text_splitter.split_documents([document])
+            else:
+                chunks = [document]
+            for chunk in chunks:
+                chunk_hash = _hash_chunk(chunk)
+                point_id = str(
+                    uuid.uuid5(_POINT_ID_NAMESPACE, f"{document_id}\0{chunk_hash}")
+                )
+                if point_id in current_point_ids:
+                    continue  # duplicated chunk in the same document
+                current_point_ids.add(point_id)
+                record = (point_id, document_id, chunk_hash)
+                if index.contains(collection, point_id):
+                    indexed.append((record, chunk))
+                    if len(indexed) >= batch_size:
+                        yield from check_indexed(indexed)
+                        indexed = []
+                else:
+                    new_records.append(record)
+                    yield point_id, chunk
+        yield from check_indexed(indexed)
+
+    embed_and_upsert(
+        vectorstore,
+        new_chunks(),
+        IngestionStats(),
+        batch_size=batch_size,
+        embed_concurrency=embed_concurrency,
+        upsert_concurrency=upsert_concurrency,
+    )
+    index.add(collection, new_records)
+    result.added = len(new_records)
+
+    orphan_point_ids = [
+        point_id
+        for point_id, document_id in index.point_ids(collection)
+        if point_id not in current_point_ids
+        and (cleanup == "full" or document_id in synced_document_ids)
+    ]
+    _delete_points(vectorstore, orphan_point_ids)
+    index.delete(collection, orphan_point_ids)
+    result.deleted = len(orphan_point_ids)
+
+    result.seconds = time.time() - start_time
+    logger.info(f"Sync of collection {collection} finished: {result.to_dict()}")
+    return result
+
+
+def collection_key(vectorstore: Qdrant) -> str:
+    """Identify the collection of the vector store by the location of its Qdrant and its name."""
+    client = vectorstore.client._client
+    # Local mode has `location`, i.e. ":memory:" or the storage folder, and remote mode has `rest_uri`.
+    location = getattr(client, "location", None) or getattr(client, "rest_uri", "")
+    return f"{location}/{vectorstore.collection_name}"
+
+
+def _count_points(vectorstore: Qdrant) -> int:
+    return vectorstore.client.count(vectorstore.collection_name, exact=True).count
+
+
+def _existing_point_ids(vectorstore: Qdrant, point_ids: List[str]) -> set:
+    if not point_ids:
+        return set()
+    points = vectorstore.client.retrieve(
+        vectorstore.collection_name, point_ids, with_payload=False, with_vectors=False
+    )
+    return {str(point.id) for point in points}
+
+
+def _hash_chunk(chunk: Document) -> str:
+    return hashlib.sha256(
+        json.dumps(
+            [chunk.page_content, chunk.metadata], sort_keys=True, default=str
+        ).encode()
+    ).hexdigest()
+
+
+def _delete_points(vectorstore: Qdrant, point_ids: List[str]):
+    from qdrant_client.http import models as rest
+
+    for i in range(0, len(point_ids), DELETE_BATCH_SIZE):
+        vectorstore.client.delete(
+            vectorstore.collection_name,
+            points_selector=rest.PointIdsList(
+                points=point_ids[i : i + DELETE_BATCH_SIZE]
+            ),
+        )
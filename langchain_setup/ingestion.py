@@ -0,0 +1,170 @@
+"""Bulk ingestion of documents into Qdrant, embedding and upserting batches concurrently."""
+import logging, threading, time, uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from itertools import islice
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from langchain.schema import Document
+from langchain.text_splitter import TextSplitter
+from langchain.vectorstores import Qdrant
+
+from .qdrant import build_points, client_lock
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class IngestionStats:
+    documents: int = 0
+    chunks: int = 0
+    batches: int = 0
+    seconds: float = 0.0
+    embed_seconds: float = 0.0
+    """Summed over batches, so it can be greater than `seconds` when batches are embedded concurrently."""
+    upsert_seconds: float = 0.0
+    """Summed over batches, so it can be greater than `seconds` when batches are upserted concurrently."""
+
+    @property
+    def documents_per_second(self) -> float:
+        return self.documents / self.seconds if self.seconds else 0.0
+
+    @property
+    def chunks_per_second(self) -> float:
+        return self.chunks / self.seconds if self.seconds else 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            **asdict(self),
+            "documents_per_second": self.documents_per_second,
+            "chunks_per_second": self.chunks_per_second,
+        }
+
+
+def ingest_documents(
+    vectorstore: Qdrant,
+    documents: Iterable[Document],
+    text_splitter: Optional[TextSplitter] = None,
+    batch_size: int = 64,
+    embed_concurrency: int = 4,
+    upsert_concurrency: int = 2,
+    max_pending_batches: Optional[int] = None,
+) -> IngestionStats:
+    """Split, embed and upsert documents into the collection of the Qdrant vector store.
+
+    Documents are consumed lazily, and at most `max_pending_batches` batches are held in memory at the same time,
+    so the memory stays flat however large the corpus is.
+
+    Args:
+        vectorstore: The Qdrant vector store, e.g. created by `create_empty_qdrant`.
+        documents: Any iterable of documents, e.g. `NotionDirectoryLoader(path).lazy_load()`.
+        text_splitter: Split documents into chunks with it if given.
+        batch_size: Number of chunks embedded and upserted together.
+        embed_concurrency: Maximum number of batches being embedded at the same time.
+        upsert_concurrency: Maximum number of batches being upserted at the same time.
+        max_pending_batches: Maximum number of batches read but not yet upserted. Default to
+            `2 * (embed_concurrency + upsert_concurrency)`.
+
+    Returns:
+        Number of documents, chunks and batches, and time spent.
+
+    Example:
+        .. code-block:: python
+
+            from langchain.document_loaders import NotionDirectoryLoader
+            from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+            stats = ingest_documents(
+                create_inmemory_empty_qdrant(),
+                NotionDirectoryLoader("data/notion").lazy_load(),
+                text_splitter=RecursiveCharacterTextSplitter(chunk_size=500),
+            )
+            print(f"{stats.documents_per_second:.1f} docs/sec")
+    """
+    stats = IngestionStats()
+    start_time = time.time()
+
+    def chunks() -> Iterator[Tuple[str, Document]]:
+        for document in documents:
+            stats.documents += 1
+            if text_splitter:
+                document_chunks = text_splitter.split_documents([document])
+            else:
+                document_chunks = [document]
+            for chunk in document_chunks:
+                yield uuid.uuid4().hex, chunk
+
+    embed_and_upsert(
+        vectorstore,
+        chunks(),
+        stats,
+        batch_size=batch_size,
+        embed_concurrency=embed_concurrency,
+        upsert_concurrency=upsert_concurrency,
+        max_pending_batches=max_pending_batches,
+    )
+    stats.seconds = time.time() - start_time
+    logger.info(f"Ingestion finished: {stats.to_dict()}")
+    return stats
+
+
+def embed_and_upsert(
+    vectorstore: Qdrant,
+    chunks: Iterable[Tuple[str, Document]],
+    stats: IngestionStats,
+    batch_size: int = 64,
+    embed_concurrency: int = 4,
+    upsert_concurrency: int = 2,
+    max_pending_batches: Optional[int] = None,
+):
+    """Embed and upsert (point id, chunk) pairs in concurrent batches, with backpressure on reading `chunks`."""
+    max_pending_batches = max_pending_batches or 2 * (
+        embed_concurrency + upsert_concurrency
+    )
+    pending_batches = threading.BoundedSemaphore(max_pending_batches)
+    errors: List[BaseException] = []
+    stats_lock = threading.Lock()
+    upsert_lock = client_lock(vectorstore)
+
+    def upsert(ids, chunks, vectors):
+        start_time = time.time()
+        points = build_points(vectorstore, ids, chunks, vectors)
+        with upsert_lock:
+            vectorstore.client.upsert(vectorstore.collection_name, points=points)
+        with stats_lock:
+            stats.upsert_seconds += time.time() - start_time
+
+    def embed_then_upsert(ids, chunks):
+        try:
+            start_time = time.time()
+            vectors = vectorstore.embeddings.embed_documents(
+                [chunk.page_content for chunk in chunks]
+            )
+            with stats_lock:
+                stats.embed_seconds += time.time() - start_time
+            # Waiting for the upsert keeps this embedding worker, so embedding can't run ahead of upserting.
+            upsert_executor.submit(upsert, ids, chunks, vectors).result()
+            with stats_lock:
+                stats.chunks += len(chunks)
+                stats.batches += 1
+        except BaseException as e:
+            errors.append(e)
+        finally:
+            pending_batches.release()
+
+    chunks = iter(chunks)
+    with ThreadPoolExecutor(
+        upsert_concurrency, thread_name_prefix="upsert"
+    ) as upsert_executor, ThreadPoolExecutor(
+        embed_concurrency, thread_name_prefix="embed"
+    ) as embed_executor:
+        while not errors:
+            pending_batches.acquire()
+            batch = list(islice(chunks, batch_size))
+            if not batch:
+                pending_batches.release()
+                break
+            ids, batch_chunks = zip(*batch)
+            embed_executor.submit(embed_then_upsert, list(ids), list(batch_chunks))
+    if errors:
+        raise errors[0]
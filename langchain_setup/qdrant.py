@@ -1,34 +1,348 @@
+import atexit, json, logging, os, threading
+from contextlib import nullcontext
+from itertools import tee
+from pathlib import Path
+from typing import TYPE_CHECKING, Dict, Iterator, List, Optional, Tuple, Union
+
 from langchain.embeddings import OpenAIEmbeddings
 from langchain.schema import Document
+from langchain.schema.embeddings import Embeddings
 from langchain.vectorstores import Qdrant
 
 from . import pprint_documents
+from .cache import DEFAULT_CACHE_DIR
+from .embedding_cache import CachedEmbeddings, embedding_identity
+
+if TYPE_CHECKING:
+    from qdrant_client import QdrantClient
+
+logger = logging.getLogger(__name__)
+
+KNOWN_EMBEDDING_DIMENSIONS = {
+    "text-embedding-ada-002": 1536,
+    "text-embedding-3-small": 1536,
+    "text-embedding-3-large": 3072,
+}
+EMBEDDING_DIMENSIONS_PATH = DEFAULT_CACHE_DIR / "embedding_dimensions.json"
+DEFAULT_QDRANT_PATH = DEFAULT_CACHE_DIR / "qdrant"
 
 
-def create_inmemory_empty_qdrant(**from_texts_kwargs):
+def create_inmemory_empty_qdrant(
+    embedding: Optional[Embeddings] = None,
+    cache_embeddings: bool = True,
+    **from_texts_kwargs,
+):
     return create_empty_qdrant(
-        location=":memory:", embedding=OpenAIEmbeddings(), **from_texts_kwargs
+        location=":memory:",
+        embedding=embedding or OpenAIEmbeddings(),
+        cache_embeddings=cache_embeddings,
+        **from_texts_kwargs,
+    )
+
+
+def create_empty_qdrant(
+    embedding: Embeddings, cache_embeddings: bool = True, **from_texts_kwargs
+):
+    """Create a Qdrant vector store with an empty collection, or reuse the existing collection.
+
+    Args:
+        embedding: The embedder.
+        cache_embeddings: Whether to wrap the embedder with `CachedEmbeddings`, so that texts already embedded
+            are not sent to the embedder again, even across processes and restarts. The cache is kept in
+            `~/.cache/langchain_setup/embedding_cache.db`, of at most 1 GiB.
+        **from_texts_kwargs: Arguments of `Qdrant.from_texts` other than `texts` and `embedding`.
+    """
+    # Qdrant requires vector size, which we get without embedding anything when possible.
+    dimension = get_embedding_dimension(embedding)
+    if cache_embeddings and not isinstance(embedding, CachedEmbeddings):
+        embedding = CachedEmbeddings(embedding)
+    vectorstore = Qdrant.construct_instance(
+        texts=["dummy"],
+        embedding=_ZeroEmbeddings(dimension=dimension),
+        **from_texts_kwargs,
     )
+    return Qdrant(
+        client=vectorstore.client,
+        collection_name=vectorstore.collection_name,
+        embeddings=embedding,
+        content_payload_key=vectorstore.content_payload_key,
+        metadata_payload_key=vectorstore.metadata_payload_key,
+        distance_strategy=vectorstore.distance_strategy,
+        vector_name=vectorstore.vector_name,
+    )
+
+
+def create_persistent_qdrant(
+    collection_name: str,
+    embedding: Optional[Embeddings] = None,
+    path=DEFAULT_QDRANT_PATH,
+    url: Optional[str] = None,
+    on_disk: bool = True,
+    hnsw_m: Optional[int] = None,
+    hnsw_ef_construct: Optional[int] = None,
+    scalar_quantization: bool = False,
+    cache_embeddings: bool = True,
+    distance_func: str = "Cosine",
+    **client_kwargs,
+):
+    """Open a Qdrant collection persisted at `path`, creating it if it doesn't exist.
+
+    The documents added are kept on restart, and reopening the collection embeds nothing. Clients of the same path
+    are shared in the process, because the local mode of Qdrant locks its storage folder.
+
+    The local mode searches by brute force over vectors loaded in RAM, so `on_disk`, `hnsw_m`, `hnsw_ef_construct`
+    and `scalar_quantization` are only applied by a Qdrant server. Pass `url` to move the same collection to a server
+    when the corpus no longer fits in RAM.
+
+    Args:
+        collection_name: Name of the collection.
+        embedding: The embedder. Default to `OpenAIEmbeddings()`.
+        path: Storage folder of the local mode.
+        url: URL of a Qdrant server, used instead of `path` if given.
+        on_disk: Store vectors in memory-mapped files instead of RAM.
+        hnsw_m: Number of edges per node of the HNSW graph. Larger is more accurate but uses more memory.
+        hnsw_ef_construct: Number of neighbours considered when building the HNSW graph. Larger is more accurate but
+            builds slower.
+        scalar_quantization: Keep int8-quantized vectors in RAM for search, which uses 4 times less memory, and
+            rescore with the original vectors.
+        cache_embeddings: See `create_empty_qdrant`.
+        distance_func: "Cosine", "Euclid" or "Dot".
+        **client_kwargs: Other arguments of `QdrantClient`, e.g. `api_key`.
+
+    Example:
+        .. code-block:: python
+
+            vectorstore = create_persistent_qdrant("notion", on_disk=True, scalar_quantization=True)
+            if not vectorstore.client.count(vectorstore.collection_name).count:
+                ingest_documents(vectorstore, NotionDirectoryLoader("data/notion").lazy_load())
+    """
+    from qdrant_client.http import models as rest
 
+    embedding = embedding or OpenAIEmbeddings()
+    dimension = get_embedding_dimension(embedding)
+    if cache_embeddings and not isinstance(embedding, CachedEmbeddings):
+        embedding = CachedEmbeddings(embedding)
+    if url:
+        client = _get_qdrant_client(url=url, **client_kwargs)
+    else:
+        client = _get_qdrant_client(path=str(Path(path).expanduser()), **client_kwargs)
 
-def create_empty_qdrant(**from_texts_kwargs):
-    # Qdrant requires vector size, which can be only know after applying embedder
-    vectorstore = Qdrant.from_texts(["dummy"], **from_texts_kwargs)
-    dummy_document_id = vectorstore.client.scroll(vectorstore.collection_name)[0][0].id
-    vectorstore.delete([dummy_document_id])
-    return vectorstore
-
-
-def pprint_qdrant_documents(vectorstore, limit: int = 100, **scroll_kwargs):
-    document_ids, documents = [], []
-    for record in vectorstore.client.scroll(
-        vectorstore.collection_name, limit=100, **scroll_kwargs
-    )[0]:
-        document_ids.append(record.id)
-        documents.append(
-            Document(
-                page_content=record.payload["page_content"],
-                metadata=record.payload["metadata"] or {},
+    distance = rest.Distance[distance_func.upper()]
+    if collection_name in _collection_names(client):
+        vectors_config = client.get_collection(collection_name).config.params.vectors
+        if vectors_config.size != dimension or vectors_config.distance != distance:
+            raise ValueError(
+                f"Existing Qdrant collection {collection_name} is configured for "
+                f"{vectors_config.size}-dimensional vectors and {vectors_config.distance.name} distance, "
+                f"but the embedder is {dimension}-dimensional and {distance.name} distance is requested."
             )
+        logger.info(f"Reopened Qdrant collection {collection_name}.")
+    else:
+        client.create_collection(
+            collection_name,
+            vectors_config=rest.VectorParams(
+                size=dimension, distance=distance, on_disk=on_disk
+            ),
+            on_disk_payload=on_disk,
+            hnsw_config=rest.HnswConfigDiff(
+                m=hnsw_m, ef_construct=hnsw_ef_construct, on_disk=on_disk
+            ),
+            quantization_config=rest.ScalarQuantization(
+                scalar=rest.ScalarQuantizationConfig(
+                    type=rest.ScalarType.INT8, always_ram=True
+                )
+            )
+            if scalar_quantization
+            else None,
+        )
+        logger.info(f"Created Qdrant collection {collection_name}.")
+    return Qdrant(
+        client=client,
+        collection_name=collection_name,
+        embeddings=embedding,
+        distance_strategy=distance.name,
+        vector_name=None,
+    )
+
+
+_qdrant_clients: Dict[str, "QdrantClient"] = {}
+_qdrant_clients_lock = threading.Lock()
+
+
+def _get_qdrant_client(**kwargs) -> "QdrantClient":
+    from qdrant_client import QdrantClient
+
+    key = json.dumps(kwargs, sort_keys=True, default=str)
+    with _qdrant_clients_lock:
+        if key not in _qdrant_clients:
+            # Upserts of the local mode are serialized by `ingest_documents`, so using SQLite from threads is safe.
+            _qdrant_clients[key] = QdrantClient(
+                force_disable_check_same_thread=True, **kwargs
+            )
+        return _qdrant_clients[key]
+
+
+@atexit.register
+def _close_qdrant_clients():
+    # Close before the interpreter tears down modules, which the local mode still needs to release its lock.
+    with _qdrant_clients_lock:
+        for client in _qdrant_clients.values():
+            client.close()
+        _qdrant_clients.clear()
+
+
+def _collection_names(client) -> List[str]:
+    return [collection.name for collection in client.get_collections().collections]
+
+
+def get_embedding_dimension(embedding: Embeddings) -> int:
+    """Get the dimension of vectors of the embedder.
+
+    It is looked up from `KNOWN_EMBEDDING_DIMENSIONS` and then the dimensions persisted at
+    `EMBEDDING_DIMENSIONS_PATH`. Only when both miss, the embedder is called once and its dimension is persisted.
+    """
+    if isinstance(embedding, CachedEmbeddings):
+        embedding = embedding.embedding
+    model = getattr(embedding, "model", None)
+    # Deployments of Azure are named by users, so they may not be the model of the same name.
+    deployment = getattr(embedding, "deployment", model)
+    if model in KNOWN_EMBEDDING_DIMENSIONS and deployment == model:
+        return KNOWN_EMBEDDING_DIMENSIONS[model]
+
+    identity = embedding_identity(embedding)
+    dimensions = _load_embedding_dimensions()
+    if identity not in dimensions:
+        logger.info(f"Probing the dimension of embedder {identity}.")
+        dimensions[identity] = len(embedding.embed_query("dummy"))
+        _save_embedding_dimensions(dimensions)
+    return dimensions[identity]
+
+
+def _load_embedding_dimensions() -> dict:
+    try:
+        with open(EMBEDDING_DIMENSIONS_PATH, encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def _save_embedding_dimensions(dimensions: dict):
+    EMBEDDING_DIMENSIONS_PATH.parent.mkdir(parents=True, exist_ok=True)
+    # Write to a temporary file then replace, so other processes never read a partially written file.
+    temporary_path = EMBEDDING_DIMENSIONS_PATH.with_suffix(f".{os.getpid()}.tmp")
+    with open(temporary_path, "w", encoding="utf-8") as f:
+        json.dump(dimensions, f, indent=1)
+    os.replace(temporary_path, EMBEDDING_DIMENSIONS_PATH)
+
+
+class _ZeroEmbeddings(Embeddings):
+    """Stands for an embedder of known dimension when Qdrant only needs the vector size."""
+
+    def __init__(self, dimension: int):
+        self.dimension = dimension
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [[0.0] * self.dimension for _ in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return [0.0] * self.dimension
+
+
+def is_local(vectorstore: Qdrant) -> bool:
+    """Whether the client of `vectorstore` runs Qdrant in local mode, in memory or in a folder."""
+    from qdrant_client.local.qdrant_local import QdrantLocal
+
+    return isinstance(getattr(vectorstore.client, "_client", None), QdrantLocal)
+
+
+def client_lock(vectorstore: Qdrant):
+    """A lock to hold while threads share the client of `vectorstore`, which does nothing for a Qdrant server."""
+    # The local mode of Qdrant is not thread-safe.
+    return threading.Lock() if is_local(vectorstore) else nullcontext()
+
+
+def build_points(vectorstore: Qdrant, ids, documents: List[Document], vectors):
+    """Points to upsert `documents` with their ids and vectors, with the payloads of `Qdrant.add_texts`."""
+    from qdrant_client.http import models as rest
+
+    payloads = Qdrant._build_payloads(
+        [document.page_content for document in documents],
+        [document.metadata for document in documents],
+        vectorstore.content_payload_key,
+        vectorstore.metadata_payload_key,
+    )
+    return [
+        rest.PointStruct(
+            id=point_id,
+            vector=vector
+            if vectorstore.vector_name is None
+            else {vectorstore.vector_name: vector},
+            payload=payload,
         )
-    pprint_documents(documents, document_ids=document_ids)
+        for point_id, vector, payload in zip(ids, vectors, payloads)
+    ]
+
+
+def iter_qdrant_documents(
+    vectorstore: Qdrant,
+    limit: Optional[int] = None,
+    page_size: int = 100,
+    **scroll_kwargs,
+) -> Iterator[Tuple[Union[int, str], Document]]:
+    """Yield (point id, document) in the collection page by page, without loading vectors.
+
+    Args:
+        vectorstore: The Qdrant vector store.
+        limit: Maximum number of documents to yield. None means all.
+        page_size: Number of points fetched per request.
+        **scroll_kwargs: Other arguments of `QdrantClient.scroll`, e.g. `scroll_filter`.
+    """
+    content_key = vectorstore.content_payload_key
+    metadata_key = vectorstore.metadata_payload_key
+    scroll_kwargs.setdefault("with_vectors", False)
+    scroll_kwargs.setdefault("with_payload", [content_key, metadata_key])
+
+    offset, count = scroll_kwargs.pop("offset", None), 0
+    while limit is None or count < limit:
+        records, offset = vectorstore.client.scroll(
+            vectorstore.collection_name,
+            limit=page_size if limit is None else min(page_size, limit - count),
+            offset=offset,
+            **scroll_kwargs,
+        )
+        for record in records:
+            yield record.id, Document(
+                page_content=record.payload.get(content_key, ""),
+                metadata=record.payload.get(metadata_key) or {},
+            )
+        count += len(records)
+        if offset is None:
+            break
+
+
+def pprint_qdrant_documents(
+    vectorstore: Qdrant,
+    limit: Optional[int] = 100,
+    page_size: int = 100,
+    max_characters: Optional[int] = None,
+    max_total_characters: Optional[int] = None,
+    metadata_keys: Optional[List[str]] = None,
+    exclude_metadata_keys: Optional[List[str]] = None,
+    **scroll_kwargs,
+):
+    """Pretty print documents in the collection, printing each one as soon as it is fetched.
+
+    `max_characters`, `max_total_characters`, `metadata_keys` and `exclude_metadata_keys` are those of
+    `pprint_documents`. No more pages are fetched once `max_total_characters` is reached.
+    """
+    id_pairs, document_pairs = tee(
+        iter_qdrant_documents(vectorstore, limit, page_size, **scroll_kwargs)
+    )
+    pprint_documents(
+        (document for _, document in document_pairs),
+        document_ids=(document_id for document_id, _ in id_pairs),
+        max_characters=max_characters,
+        max_total_characters=max_total_characters,
+        metadata_keys=metadata_keys,
+        exclude_metadata_keys=exclude_metadata_keys,
+    )
@@ -0,0 +1,279 @@
+"""Client-side rate limiting of OpenAI models by requests and tokens per minute, shared per model/deployment."""
+import asyncio, math, os, threading, time
+from contextvars import ContextVar
+from typing import Any, Dict, Optional, Tuple
+
+from .tokens import count_tokens
+
+DEFAULT_BURST_SECONDS = 10
+"""Buckets hold this many seconds of the rate, so that a burst can't use up a whole minute of quota at once."""
+
+_quota_reserved: ContextVar[bool] = ContextVar("quota_reserved", default=False)
+"""Set while generating with the quota already reserved, e.g. when `_generate` streams with `streaming=True`."""
+
+
+class TokenBucket:
+    """Thread-safe token bucket refilled at a constant rate.
+
+    Amounts are reserved at once, and the bucket goes into debt if there is not enough, returning how long the caller
+    should wait for the debt to be refilled. So nobody waits while holding the lock, and callers are served in order,
+    which works the same for threads (`time.sleep`) and coroutines (`asyncio.sleep`).
+    """
+
+    def __init__(self, rate_per_second: float, capacity: float):
+        self.rate_per_second = rate_per_second
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount: float) -> float:
+        """Take `amount` from the bucket, and return seconds to wait before using it."""
+        with self._lock:
+            self._refill()
+            self._tokens -= amount
+            return max(0.0, -self._tokens / self.rate_per_second)
+
+    def refund(self, amount: float):
+        """Give back (or take more if negative) the difference between the reserved and the actual amount."""
+        with self._lock:
+            self._refill()
+            self._tokens = min(self.capacity, self._tokens + amount)
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(
+            self.capacity, self._tokens + (now - self._updated_at) * self.rate_per_second
+        )
+        self._updated_at = now
+
+
+class RateLimiter:
+    """Limit requests per minute and tokens per minute, with metrics of how long callers waited in the queue.
+
+    Example:
+        .. code-block:: python
+
+            limiter = RateLimiter(requests_per_minute=300, tokens_per_minute=40_000)
+            limiter.acquire(tokens=estimated_tokens)  # Or `await limiter.aacquire(...)`
+            response = call_openai()
+            limiter.refund(estimated_tokens - response["usage"]["total_tokens"])
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: Optional[float] = None,
+        tokens_per_minute: Optional[float] = None,
+        burst_seconds: float = DEFAULT_BURST_SECONDS,
+    ):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._request_bucket = _create_bucket(requests_per_minute, burst_seconds)
+        self._token_bucket = _create_bucket(tokens_per_minute, burst_seconds)
+        self.requests = 0
+        self.tokens = 0
+        self.waits = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def reserve(self, tokens: int = 0, requests: int = 1) -> float:
+        """Reserve quota for the requests, and return seconds to wait before sending them."""
+        wait = 0.0
+        if self._request_bucket:
+            wait = max(wait, self._request_bucket.reserve(requests))
+        if self._token_bucket and tokens:
+            wait = max(wait, self._token_bucket.reserve(tokens))
+        with self._lock:
+            self.requests += requests
+            self.tokens += tokens
+            if wait > 0:
+                self.waits += 1
+                self.wait_seconds += wait
+                self.max_wait_seconds = max(self.max_wait_seconds, wait)
+        return wait
+
+    def acquire(self, tokens: int = 0, requests: int = 1):
+        wait = self.reserve(tokens, requests)
+        if wait > 0:
+            time.sleep(wait)
+
+    async def aacquire(self, tokens: int = 0, requests: int = 1):
+        wait = self.reserve(tokens, requests)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def refund(self, tokens: int):
+        """Correct the reserved tokens by the difference from the actual usage, which may be negative."""
+        if self._token_bucket and tokens:
+            self._token_bucket.refund(tokens)
+            with self._lock:
+                self.tokens -= tokens
+
+    def stats(self) -> Dict[str, Any]:
+        """Requests and tokens let through, and the time callers waited in the queue."""
+        return {
+            "requests_per_minute": self.requests_per_minute,
+            "tokens_per_minute": self.tokens_per_minute,
+            "requests": self.requests,
+            "tokens": self.tokens,
+            "waits": self.waits,
+            "wait_seconds": self.wait_seconds,
+            "average_wait_seconds": self.wait_seconds / self.requests
+            if self.requests
+            else None,
+            "max_wait_seconds": self.max_wait_seconds,
+        }
+
+
+def _create_bucket(per_minute: Optional[float], burst_seconds: float) -> Optional[TokenBucket]:
+    if not per_minute:
+        return None
+    rate_per_second = per_minute / 60
+    return TokenBucket(rate_per_second, capacity=max(1.0, rate_per_second * burst_seconds))
+
+
+_limits: Dict[Optional[str], Tuple[Optional[float], Optional[float]]] = {}
+_rate_limiters: Dict[str, Optional[RateLimiter]] = {}
+_rate_limiters_lock = threading.Lock()
+
+
+def set_rate_limit(
+    model: Optional[str] = None,
+    requests_per_minute: Optional[float] = None,
+    tokens_per_minute: Optional[float] = None,
+):
+    """Set the rate limit of the model or Azure deployment, or of all of them if `model` is None.
+
+    It overrides environment variables `OPENAI_REQUESTS_PER_MINUTE` and `OPENAI_TOKENS_PER_MINUTE`, which are the
+    default limits of all models. Models without any limit are not limited.
+    """
+    with _rate_limiters_lock:
+        _limits[model] = (requests_per_minute, tokens_per_minute)
+        if model is None:
+            _rate_limiters.clear()
+        else:
+            _rate_limiters.pop(model, None)
+
+
+def get_rate_limiter(model: str) -> Optional[RateLimiter]:
+    """The rate limiter shared by all instances of the model or Azure deployment in the process."""
+    with _rate_limiters_lock:
+        if model not in _rate_limiters:
+            limits = _limits.get(model) or _limits.get(None)
+            if limits is None:
+                limits = (
+                    _float_from_env("OPENAI_REQUESTS_PER_MINUTE"),
+                    _float_from_env("OPENAI_TOKENS_PER_MINUTE"),
+                )
+            _rate_limiters[model] = RateLimiter(*limits) if any(limits) else None
+        return _rate_limiters[model]
+
+
+def rate_limiter_stats() -> Dict[str, Dict[str, Any]]:
+    """Stats of the rate limiters of all models and deployments used."""
+    with _rate_limiters_lock:
+        limiters = dict(_rate_limiters)
+    return {model: limiter.stats() for model, limiter in limiters.items() if limiter}
+
+
+def _float_from_env(name: str) -> Optional[float]:
+    return float(os.environ[name]) if os.environ.get(name) else None
+
+
+class RateLimitMixin:
+    """Mix into a langchain OpenAI LLM or chat model class to wait for its rate limiter before every generation.
+
+    Prompt tokens are estimated with tiktoken and `max_tokens` is reserved for the completion, then the difference
+    from the token usage in the response is refunded.
+    """
+
+    def _rate_limiter(self) -> Optional[RateLimiter]:
+        model = getattr(self, "deployment_name", None) or getattr(self, "model_name", None)
+        return get_rate_limiter(model) if model else None
+
+    def _estimate_usage(self, inputs) -> Tuple[int, int]:
+        """(Tokens, requests) of generating `inputs`, a list of prompts or a list of messages."""
+        max_tokens = max(getattr(self, "max_tokens", None) or 0, 0)
+        if inputs and isinstance(inputs[0], str):
+            # `BaseOpenAI` sends prompts in batches of `batch_size`.
+            requests = math.ceil(len(inputs) / getattr(self, "batch_size", 1))
+            tokens = count_tokens(
+                lambda: sum(self.get_num_tokens(prompt) for prompt in inputs),
+                "".join(inputs),
+            )
+            return tokens + max_tokens * len(inputs), requests
+
+        def count_message_tokens():
+            try:
+                return self.get_num_tokens_from_messages(inputs)
+            except NotImplementedError:
+                return sum(self.get_num_tokens(str(m.content)) for m in inputs)
+
+        tokens = count_tokens(
+            count_message_tokens, "".join(str(m.content) for m in inputs)
+        )
+        return tokens + max_tokens, 1
+
+    def _refund(self, limiter: RateLimiter, reserved_tokens: int, result):
+        usage = ((result.llm_output or {}).get("token_usage") or {}).get("total_tokens")
+        if usage is not None:
+            limiter.refund(reserved_tokens - usage)
+
+    def _generate(self, inputs, stop=None, run_manager=None, **kwargs):
+        limiter = self._rate_limiter()
+        if limiter is None or _quota_reserved.get():
+            return super()._generate(inputs, stop=stop, run_manager=run_manager, **kwargs)
+        tokens, requests = self._estimate_usage(inputs)
+        limiter.acquire(tokens, requests)
+        # With `streaming=True`, the generation goes through `_stream`, which shouldn't reserve again.
+        reserved = _quota_reserved.set(True)
+        try:
+            result = super()._generate(inputs, stop=stop, run_manager=run_manager, **kwargs)
+        finally:
+            _quota_reserved.reset(reserved)
+        self._refund(limiter, tokens, result)
+        return result
+
+    async def _agenerate(self, inputs, stop=None, run_manager=None, **kwargs):
+        limiter = self._rate_limiter()
+        if limiter is None or _quota_reserved.get():
+            return await super()._agenerate(
+                inputs, stop=stop, run_manager=run_manager, **kwargs
+            )
+        tokens, requests = self._estimate_usage(inputs)
+        await limiter.aacquire(tokens, requests)
+        reserved = _quota_reserved.set(True)
+        try:
+            result = await super()._agenerate(
+                inputs, stop=stop, run_manager=run_manager, **kwargs
+            )
+        finally:
+            _quota_reserved.reset(reserved)
+        self._refund(limiter, tokens, result)
+        return result
+
+    def _stream(self, inputs, stop=None, run_manager=None, **kwargs):
+        limiter = self._rate_limiter()
+        if limiter is not None and not _quota_reserved.get():
+            limiter.acquire(*self._estimate_usage(self._stream_inputs(inputs)))
+        yield from super()._stream(inputs, stop=stop, run_manager=run_manager, **kwargs)
+
+    async def _astream(self, inputs, stop=None, run_manager=None, **kwargs):
+        limiter = self._rate_limiter()
+        if limiter is not None and not _quota_reserved.get():
+            await limiter.aacquire(*self._estimate_usage(self._stream_inputs(inputs)))
+        async for chunk in super()._astream(
+            inputs, stop=stop, run_manager=run_manager, **kwargs
+        ):
+            yield chunk
+
+    @staticmethod
+    def _stream_inputs(inputs):
+        # LLMs stream a single prompt, while chat models stream a list of messages.
+        return [inputs] if isinstance(inputs, str) else inputs
+
+
+def with_rate_limit(cls):
+    """Create a subclass of the langchain model class `cls` with `RateLimitMixin`, keeping its name and module."""
+    return type(cls.__name__, (RateLimitMixin, cls), {"__module__": cls.__module__})
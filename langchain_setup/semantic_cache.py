@@ -0,0 +1,226 @@
+"""Semantic LLM cache in Qdrant, which also hits for prompts similar to, but not the same as, cached prompts."""
+import hashlib, logging, threading, time, uuid
+from typing import Any, Dict, Optional
+
+from langchain.load.dump import dumps
+from langchain.load.load import loads
+from langchain.schema import Document
+from langchain.schema.cache import RETURN_VAL_TYPE, BaseCache
+from langchain.schema.embeddings import Embeddings
+
+from .cache import is_failed_generation
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SCORE_THRESHOLD = 0.95
+_POINT_ID_NAMESPACE = uuid.UUID("0b7c4a52-5d0e-4f8e-a3f1-6c2d9e8b1a47")
+
+
+class SemanticLLMCache(BaseCache):
+    """LLM cache returning the generations of the most similar cached prompt of the same model and parameters,
+    if its cosine similarity is at least `score_threshold`.
+
+    Prompts are embedded and stored in a Qdrant collection, in memory or persisted by `create_persistent_qdrant`.
+    Only prompts of the same llm string, which langchain makes from the identifying parameters of the model and the
+    stop words, are searched, so generations of different models or temperatures are never mixed up.
+
+    Example:
+        .. code-block:: python
+
+            from langchain.globals import set_llm_cache
+            from langchain_setup.semantic_cache import SemanticLLMCache
+
+            set_llm_cache(SemanticLLMCache(path="~/.cache/langchain_setup/semantic_cache", max_age=24 * 3600))
+            chat_model.predict("How do I reset my password?")
+            chat_model.predict("How can I reset my password?")  # Hit
+    """
+
+    def __init__(
+        self,
+        embedding: Optional[Embeddings] = None,
+        score_threshold: float = DEFAULT_SCORE_THRESHOLD,
+        path=None,
+        collection_name: str = "llm_cache",
+        max_age: Optional[float] = None,
+        eviction_interval: int = 100,
+    ):
+        """
+        Args:
+            embedding: The embedder of prompts. Default to `OpenAIEmbeddings()`.
+            score_threshold: Minimum cosine similarity between prompts to hit. Too low returns answers of different
+                questions, so it should be tuned with real prompts of the application.
+            path: Storage folder of the Qdrant local mode. None means in memory.
+            collection_name: Name of the Qdrant collection.
+            max_age: Seconds after which an entry expires. None means never.
+            eviction_interval: Delete expired entries every `eviction_interval` updates of this process.
+        """
+        from langchain.embeddings import OpenAIEmbeddings
+
+        from .qdrant import client_lock, create_empty_qdrant, create_persistent_qdrant
+
+        embedding = embedding or OpenAIEmbeddings()
+        if path is None:
+            self.vectorstore = create_empty_qdrant(
+                embedding, location=":memory:", collection_name=collection_name
+            )
+        else:
+            self.vectorstore = create_persistent_qdrant(
+                collection_name, embedding, path=path
+            )
+        self.score_threshold = score_threshold
+        self.max_age = max_age
+        self.eviction_interval = eviction_interval
+        self.hits = 0
+        self.misses = 0
+        self.lookup_seconds = 0.0
+        self._updates = 0
+        self._lock = threading.Lock()
+        self._client_lock = client_lock(self.vectorstore)
+
+    def lookup(self, prompt: str, llm_string: str) -> Optional[RETURN_VAL_TYPE]:
+        """Look up based on prompt and llm_string."""
+        from qdrant_client.http import models as rest
+
+        start_time = time.perf_counter()
+        conditions = [
+            rest.FieldCondition(
+                key=self._metadata_key("llm_string"),
+                match=rest.MatchValue(value=_hash(llm_string)),
+            )
+        ]
+        if self.max_age:
+            conditions.append(
+                rest.FieldCondition(
+                    key=self._metadata_key("created_at"),
+                    range=rest.Range(gte=time.time() - self.max_age),
+                )
+            )
+        vector = self.vectorstore.embeddings.embed_query(_prompt_text(prompt))
+        with self._client_lock:
+            results = self.vectorstore.similarity_search_with_score_by_vector(
+                vector,
+                k=1,
+                filter=rest.Filter(must=conditions),
+                score_threshold=self.score_threshold,
+            )
+        hit = bool(results)
+        with self._lock:
+            self.lookup_seconds += time.perf_counter() - start_time
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if not hit:
+            return None
+        document, score = results[0]
+        logger.debug(f"Semantic cache hit with similarity {score:.3f}: {document.page_content!r}")
+        return loads(document.metadata["generations"])
+
+    def update(self, prompt: str, llm_string: str, return_val: RETURN_VAL_TYPE) -> None:
+        """Update cache based on prompt and llm_string."""
+        if is_failed_generation(return_val):
+            return
+
+        from .qdrant import build_points
+
+        llm_string_hash = _hash(llm_string)
+        document = Document(
+            page_content=_prompt_text(prompt),
+            metadata={
+                "llm_string": llm_string_hash,
+                "generations": dumps(list(return_val)),
+                "created_at": time.time(),
+            },
+        )
+        # The same prompt of the same model overwrites the old entry.
+        point_id = str(uuid.uuid5(_POINT_ID_NAMESPACE, f"{llm_string_hash}\0{prompt}"))
+        vector = self.vectorstore.embeddings.embed_query(document.page_content)
+        with self._client_lock:
+            self.vectorstore.client.upsert(
+                self.vectorstore.collection_name,
+                points=build_points(self.vectorstore, [point_id], [document], [vector]),
+            )
+        with self._lock:
+            self._updates += 1
+            evict = self.max_age and self._updates % self.eviction_interval == 0
+        if evict:
+            self.evict()
+
+    def evict(self):
+        """Delete expired entries."""
+        from qdrant_client.http import models as rest
+
+        if not self.max_age:
+            return
+        with self._client_lock:
+            self.vectorstore.client.delete(
+                self.vectorstore.collection_name,
+                points_selector=rest.FilterSelector(
+                    filter=rest.Filter(
+                        must=[
+                            rest.FieldCondition(
+                                key=self._metadata_key("created_at"),
+                                range=rest.Range(lt=time.time() - self.max_age),
+                            )
+                        ]
+                    )
+                ),
+            )
+
+    def clear(self, **kwargs: Any) -> None:
+        """Clear cache."""
+        from qdrant_client.http import models as rest
+
+        with self._client_lock:
+            self.vectorstore.client.delete(
+                self.vectorstore.collection_name,
+                points_selector=rest.FilterSelector(filter=rest.Filter()),
+            )
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters and average lookup latency (including embedding the prompt) of this process, and
+        the number of entries in the collection."""
+        lookups = self.hits + self.misses
+        with self._client_lock:
+            entries = self.vectorstore.client.count(
+                self.vectorstore.collection_name
+            ).count
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else None,
+            "average_lookup_ms": self.lookup_seconds / lookups * 1000 if lookups else None,
+            "entries": entries,
+        }
+
+    def _metadata_key(self, key: str) -> str:
+        return f"{self.vectorstore.metadata_payload_key}.{key}"
+
+
+def _hash(text: str) -> str:
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def _prompt_text(prompt: str) -> str:
+    """Chat models pass their messages serialized as the prompt, which are turned back into readable text,
+    so that embeddings reflect the conversation rather than the serialization format."""
+    if not prompt.startswith("[{"):
+        return prompt
+    try:
+        messages = loads(prompt)
+    except (ValueError, TypeError, KeyError, NotImplementedError):
+        return prompt
+    return "\n".join(
+        f"{getattr(message, 'type', 'message')}: {getattr(message, 'content', message)}"
+        for message in messages
+    )
+
+
+def enable_semantic_llm_cache(**kwargs) -> SemanticLLMCache:
+    """Install `SemanticLLMCache` as the global LLM cache used by all models, and return it."""
+    from langchain.globals import get_llm_cache, set_llm_cache
+
+    if not isinstance(get_llm_cache(), SemanticLLMCache):
+        set_llm_cache(SemanticLLMCache(**kwargs))
+        logger.info("Semantic LLM cache is enabled.")
+    return get_llm_cache()
@@ -0,0 +1,209 @@
+"""Map-reduce summarization packing documents by tokens, with concurrent map calls and streamed partial summaries."""
+import asyncio, logging, time
+from dataclasses import asdict, dataclass, field
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Sequence
+
+from langchain.prompts import PromptTemplate
+from langchain.schema import Document
+from langchain.schema.language_model import BaseLanguageModel
+from langchain.schema.output_parser import StrOutputParser
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+from .tokens import CHARACTERS_PER_TOKEN, tiktoken_counter
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PROMPT = PromptTemplate.from_template(
+    "請為下面的文章段落寫一句精準的摘要:\n\n\n「{text}」\n\n\n精準摘要:"
+)
+DEFAULT_TOKEN_BUDGET = 3000
+"""Tokens of text per call, which should leave room in the context window for the prompt and the summary."""
+DEFAULT_MAX_COLLAPSE_LEVELS = 10
+
+
+@dataclass
+class SummaryEvent:
+    stage: str
+    """"map" for summaries of chunks, "collapse" for summaries of summaries, and "final" for the final summary."""
+    level: int
+    """0 for the map stage, and increased by 1 for every collapse."""
+    index: int
+    """Position of the chunk or group of summaries in its level."""
+    text: str
+
+
+@dataclass
+class SummarizationStats:
+    documents: int = 0
+    chunks: int = 0
+    calls: int = 0
+    collapse_levels: int = 0
+    seconds: float = 0.0
+    calls_by_stage: Dict[str, int] = field(default_factory=dict)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+class MapReduceSummarizer:
+    """Summarize documents of any length with as few and as concurrent calls as possible.
+
+    1. Documents are packed into chunks of up to `token_budget` tokens counted by tiktoken, instead of the small
+       chunks sized by characters of a text splitter, so there are fewer calls with the context window well used.
+    2. Chunks are summarized concurrently, at most `max_concurrency` at the same time.
+    3. Summaries are packed and summarized again only while they don't fit in one call, then summarized into the
+       final summary. When the documents fit in one chunk, it takes only one call. If summaries are too long to be
+       packed at least two per call, they are truncated, so that every collapse level at least halves them.
+
+    Example:
+        .. code-block:: python
+
+            summarizer = MapReduceSummarizer(ChatOpenAI(), max_concurrency=16)
+            # In a notebook, where an event loop is already running
+            async for event in summarizer.astream(documents):
+                print(event.stage, event.index, event.text)
+            # Elsewhere
+            print(summarizer.summarize(documents))
+    """
+
+    def __init__(
+        self,
+        llm: BaseLanguageModel,
+        map_prompt: PromptTemplate = DEFAULT_PROMPT,
+        combine_prompt: Optional[PromptTemplate] = None,
+        token_budget: int = DEFAULT_TOKEN_BUDGET,
+        max_concurrency: int = 8,
+        count_tokens: Optional[Callable[[str], int]] = None,
+        separator: str = "\n\n",
+        max_collapse_levels: int = DEFAULT_MAX_COLLAPSE_LEVELS,
+    ):
+        """
+        Args:
+            llm: A LLM or chat model, e.g. `ChatOpenAI()` or `TextGen()`.
+            map_prompt: Prompt summarizing a chunk, with input variable `text`.
+            combine_prompt: Prompt summarizing summaries, with input variable `text`. Default to `map_prompt`.
+            token_budget: Maximum tokens of text in a call.
+            max_concurrency: Maximum number of calls at the same time.
+            count_tokens: Count tokens of a text. Default to tiktoken of the model, or characters / 4 if tiktoken is
+                not available.
+            separator: Joins texts packed in the same call.
+            max_collapse_levels: Raise `ValueError` if summaries still don't fit in one call after this many levels of
+                summarizing summaries.
+        """
+        self.llm = llm
+        self.map_chain = map_prompt | llm | StrOutputParser()
+        self.combine_chain = (combine_prompt or map_prompt) | llm | StrOutputParser()
+        self.token_budget = token_budget
+        self.max_concurrency = max_concurrency
+        self.count_tokens = count_tokens or tiktoken_counter(llm)
+        self.separator = separator
+        self.max_collapse_levels = max_collapse_levels
+        self.stats = SummarizationStats()
+
+    def summarize(self, documents: Sequence[Document]) -> str:
+        """Summarize in a new event loop. Use `asummarize` where an event loop is already running, e.g. notebooks."""
+        return asyncio.run(self.asummarize(documents))
+
+    async def asummarize(self, documents: Sequence[Document]) -> str:
+        async for event in self.astream(documents):
+            if event.stage == "final":
+                return event.text
+        return ""
+
+    async def astream(self, documents: Sequence[Document]) -> AsyncIterator[SummaryEvent]:
+        """Yield every summary as soon as it is written, ending with the final summary."""
+        self.stats = SummarizationStats(documents=len(documents))
+        start_time = time.perf_counter()
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        chunks = self.pack([document.page_content for document in documents])
+        self.stats.chunks = len(chunks)
+        if not chunks:
+            return
+        stage, level, chain = "map", 0, self.map_chain
+        while True:
+            if len(chunks) == 1:
+                stage = "final"
+            summaries = [""] * len(chunks)
+            async for index, summary in self._summarize_concurrently(
+                chain, chunks, semaphore, stage
+            ):
+                summaries[index] = summary
+                self.stats.seconds = time.perf_counter() - start_time
+                if stage == "final":
+                    logger.info(f"Summarization finished: {self.stats.to_dict()}")
+                yield SummaryEvent(stage, level, index, summary)
+            if stage == "final":
+                break
+            stage, level, chain = "collapse", level + 1, self.combine_chain
+            packed_chunks = self.pack(summaries)
+            if len(packed_chunks) >= len(chunks):
+                # Summaries are longer than half of the budget, so packing them doesn't reduce the calls.
+                max_tokens = (self.token_budget - self.count_tokens(self.separator)) // 2
+                logger.warning(
+                    f"Summaries at level {level} don't shrink, truncating them to {max_tokens} tokens."
+                )
+                packed_chunks = self.pack(
+                    [self._truncate(summary, max_tokens) for summary in summaries]
+                )
+            chunks = packed_chunks
+            if len(chunks) > 1:
+                self.stats.collapse_levels += 1
+                if self.stats.collapse_levels > self.max_collapse_levels:
+                    raise ValueError(
+                        f"Summaries still don't fit in one call after {self.max_collapse_levels} collapse levels. "
+                        "Increase `token_budget` or ask for shorter summaries in the prompts."
+                    )
+
+    def pack(self, texts: Sequence[str]) -> List[str]:
+        """Pack consecutive texts into as few chunks of at most `token_budget` tokens as possible, splitting texts
+        longer than that."""
+        separator_tokens = self.count_tokens(self.separator)
+        splitter = RecursiveCharacterTextSplitter(
+            chunk_size=self.token_budget, chunk_overlap=0, length_function=self.count_tokens
+        )
+        chunks: List[str] = []
+        current: List[str] = []
+        current_tokens = 0
+        for text in texts:
+            tokens = self.count_tokens(text)
+            pieces = splitter.split_text(text) if tokens > self.token_budget else [text]
+            for piece in pieces:
+                if len(pieces) > 1:
+                    tokens = self.count_tokens(piece)
+                if current and current_tokens + separator_tokens + tokens > self.token_budget:
+                    chunks.append(self.separator.join(current))
+                    current, current_tokens = [], 0
+                current_tokens += tokens + (separator_tokens if current else 0)
+                current.append(piece)
+        if current:
+            chunks.append(self.separator.join(current))
+        return chunks
+
+    def _truncate(self, text: str, max_tokens: int) -> str:
+        if self.count_tokens(text) <= max_tokens:
+            return text
+        splitter = RecursiveCharacterTextSplitter(
+            chunk_size=max_tokens, chunk_overlap=0, length_function=self.count_tokens
+        )
+        text = splitter.split_text(text)[0]
+        if self.count_tokens(text) > max_tokens:
+            # A piece without any separator to split at.
+            text = text[: max_tokens * CHARACTERS_PER_TOKEN]
+        return text
+
+    async def _summarize_concurrently(self, chain, chunks, semaphore, stage):
+        async def summarize(index: int, chunk: str):
+            async with semaphore:
+                summary = await chain.ainvoke({"text": chunk})
+            self.stats.calls += 1
+            self.stats.calls_by_stage[stage] = self.stats.calls_by_stage.get(stage, 0) + 1
+            return index, summary
+
+        tasks = [asyncio.ensure_future(summarize(i, chunk)) for i, chunk in enumerate(chunks)]
+        try:
+            for task in asyncio.as_completed(tasks):
+                yield await task
+        finally:
+            for task in tasks:
+                task.cancel()
@@ -1,10 +1,21 @@
 """Wrapper around text-generation-webui."""
-import logging, os, requests, socket
-from typing import Any, Dict, List, Optional
-
-from langchain.pydantic_v1 import Field, root_validator
-from langchain.callbacks.manager import CallbackManagerForLLMRun
+import asyncio, atexit, json, logging, os, requests, socket, threading, time, weakref
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
+from functools import lru_cache
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Sequence
+
+from langchain.pydantic_v1 import Field, PrivateAttr, root_validator
+from langchain.callbacks.manager import (
+    AsyncCallbackManagerForLLMRun,
+    CallbackManagerForLLMRun,
+)
 from langchain.llms.base import LLM
+from langchain.schema import Generation, LLMResult
+from langchain.schema.output import GenerationChunk
+
+from .cache import enable_llm_cache_if_configured
+from .coalescing import is_deterministic, single_flight
 
 logger = logging.getLogger(__name__)
 
@@ -12,6 +23,8 @@ DEFAULT_HOST_NAME = "localhost"
 DEFAULT_API_BLOCKING_PORT = 5000
 DEFAULT_API_STREAMING_PORT = 5005
 
+enable_llm_cache_if_configured()
+
 
 class TextGen(LLM):
     """Wrapper around the text-generation-webui model.
@@ -40,6 +53,7 @@ class TextGen(LLM):
                 http_addr_or_http_name_or_ssh_name_of_remote_host,
                 api_blocking_port=6001,
                 api_streaming_port=6002,
+                via_ssh=True,
             ) # automatically setup SSH tunnels for you ❤️
     """
 
@@ -52,7 +66,42 @@ class TextGen(LLM):
     api_streaming_port: Optional[int] = None
     """Host port of streaming api. If it is not set, use environment variable `textgen_api_streaming_port`."""
 
+    backends: Optional[List[str]] = None
+    """Multiple servers in the form of `host[:blocking_port[:streaming_port]]`, which override `host_name_or_address`.
+    Each request is routed to the backend with the least outstanding requests. Omitted ports default to
+    `api_blocking_port` and `api_streaming_port`."""
+    backend_max_failures: int = 3
+    """Number of consecutive failures after which a backend is ejected from routing."""
+    backend_cooldown: float = 30
+    """Seconds before an ejected backend is routed to again."""
+
+    via_ssh: bool = False
+    """Whether to reach the apis through SSH tunnels to the host in `~/.ssh/config` corresponding to `host_name_or_address`.
+    Tunnels are started on the first request and shared by all instances in the process."""
+
     streaming: bool = False
+    """Whether to generate through the streaming api, token by token."""
+
+    max_connections: int = 100
+    """Maximum number of concurrent connections of the async http client shared by instances of the same host and port."""
+    max_keepalive_connections: int = 20
+    """Maximum number of idle connections kept alive by the shared async http client."""
+    request_timeout: Optional[float] = 600
+    """Timeout in seconds of a request, or of waiting for the next token when streaming. None means waiting forever."""
+    max_retries: int = 3
+    """Maximum number of retries on connection errors and 5xx responses. Read timeouts are not retried, because the
+    generation may still be running on the server."""
+    retry_backoff_factor: float = 0.5
+    """Retries wait `retry_backoff_factor * 2 ** (retry_number - 1)` seconds before being sent."""
+    max_concurrency: int = 8
+    """Maximum number of prompts of a batch being generated at the same time."""
+    return_failed_generations: bool = False
+    """Whether a prompt of a batch that failed gets an empty generation with the error in `generation_info["error"]`,
+    instead of raising `PartialGenerationError`. Note that `batch` and chains only return the text of generations."""
+    coalesce_requests: bool = True
+    """Whether concurrent identical requests share one generation, when the generation is deterministic and not streaming."""
+    model_info_ttl: float = 60
+    """Seconds before the cached model info is refreshed in the background."""
 
     # Length
 
@@ -140,6 +189,10 @@ class TextGen(LLM):
     stopping_strings: Optional[List[str]] = Field(default_factory=list)
     """A list of strings to stop generation when encountered."""
 
+    _ssh_tunnels: Dict[tuple, tuple] = PrivateAttr(default_factory=dict)
+    """(host, remote port) -> (local bind port, finalizer releasing the tunnel)"""
+    _backend_list: List["_Backend"] = PrivateAttr(default_factory=list)
+
     @root_validator()
     def validate_environment(cls, values: Dict) -> Dict:
         # Check values
@@ -158,46 +211,13 @@ class TextGen(LLM):
         # It seems that gradio server can't properly handle proxy (?)
         os.environ["no_proxy"] = "localhost, 127.0.0.1"
 
-        # HTTP address
-        try:
-            http_addr = socket.gethostbyname(values["host_name_or_address"])
-            via_ssh = http_addr != "127.0.0.1" or http_addr != get_curreent_ip()
-        except:
-            via_ssh = True
-
-        # Check whether direct connection is available before setting SSH Tunnel ?
-        via_ssh = False
-
-        # Create SSH tunnel if needed
-        if via_ssh:
-            from sshconf import read_ssh_config_file
-
-            ssh_cfg = read_ssh_config_file(os.path.expanduser("~/.ssh/config"))
-            ssh_hostnames = [
-                host
-                for host in ssh_cfg.hosts()
-                if host == values["host_name_or_address"]
-                or socket.gethostbyname(ssh_cfg.host(host)["hostname"])
-                == values["host_name_or_address"]
-            ]
-            if len(ssh_hostnames) == 0:
-                raise ValueError(
-                    f"Did not find any SSH host name corresponds to {values['host_name_or_address']} in `~/.ssh/config`."
-                )
-            elif len(ssh_hostnames) > 1:
-                raise ValueError(
-                    f"Multiple SSH host {ssh_hostnames} correspond to {values['host_name_or_address']} in `~/.ssh/config`."
-                )
-            ssh_hostname = ssh_hostnames[0]
-            api_blocking_tunnel, api_streaming_tunnel = _setup_ssh_tunnels(
-                ssh_host_name=ssh_hostname,
-                api_blocking_port=values["api_blocking_port"],
-                api_streaming_port=values["api_streaming_port"],
+        # Fail early if the SSH host can't be found. Tunnels themselves are started on the first request.
+        for spec in values["backends"] or [values["host_name_or_address"]]:
+            host, _, _ = _parse_backend(
+                spec, values["api_blocking_port"], values["api_streaming_port"]
             )
-
-            values["host_name_or_address"] = "127.0.0.1"
-            values["api_blocking_port"] = api_blocking_tunnel.local_bind_port
-            values["api_streaming_port"] = api_streaming_tunnel.local_bind_port
+            if values["via_ssh"]:
+                _resolve_ssh_host_name(host)
 
         return values
 
@@ -237,6 +257,7 @@ class TextGen(LLM):
                 "host_name_or_address": self.host_name_or_address,
                 "api_blocking_port": self.api_blocking_port,
                 "api_streaming_port": self.api_streaming_port,
+                "backends": self.backends,
             },
             **self._default_params,
         }
@@ -269,6 +290,60 @@ class TextGen(LLM):
 
         return params
 
+    def _generate(
+        self,
+        prompts: List[str],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> LLMResult:
+        """Generate for prompts concurrently, at most `max_concurrency` of them at the same time.
+
+        A prompt that failed doesn't abort the others. When all the prompts are done, `PartialGenerationError` is
+        raised with the generations of the others, unless `return_failed_generations` is set.
+
+        With `streaming`, prompts are generated one after another, because all of them stream tokens to the same
+        `run_manager`, whose callbacks would otherwise get tokens of different prompts interleaved.
+        """
+
+        def call(prompt):
+            try:
+                return self._call(prompt, stop=stop, run_manager=run_manager, **kwargs)
+            except Exception as e:
+                return e
+
+        if len(prompts) == 1:
+            results = [
+                self._call(prompts[0], stop=stop, run_manager=run_manager, **kwargs)
+            ]
+        elif self.streaming:
+            results = [call(prompt) for prompt in prompts]
+        else:
+            with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+                results = list(executor.map(call, prompts))
+        return _results_to_llm_result(results, self.return_failed_generations)
+
+    async def _agenerate(
+        self,
+        prompts: List[str],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> LLMResult:
+        """Async version of `_generate`."""
+        semaphore = asyncio.Semaphore(1 if self.streaming else self.max_concurrency)
+
+        async def acall(prompt):
+            async with semaphore:
+                return await self._acall(
+                    prompt, stop=stop, run_manager=run_manager, **kwargs
+                )
+
+        results = await asyncio.gather(
+            *[acall(prompt) for prompt in prompts], return_exceptions=len(prompts) > 1
+        )
+        return _results_to_llm_result(results, self.return_failed_generations)
+
     def _call(
         self,
         prompt: str,
@@ -293,30 +368,721 @@ class TextGen(LLM):
                 llm("Write a story about llamas.")
         """
         if self.streaming:
-            raise NotImplementedError
+            result = ""
+            for chunk in self._stream(
+                prompt=prompt, stop=stop, run_manager=run_manager, **kwargs
+            ):
+                result += chunk.text
+            return result
+
+        params = self._get_parameters(stop)
+        request = params.copy()
+        request["prompt"] = prompt
+        if self._coalescable:
+            return single_flight.do(
+                self._coalescing_key(request),
+                lambda: self._request_generation(request),
+            )
+        return self._request_generation(request)
+
+    def _request_generation(self, request: Dict[str, Any]) -> str:
+        failed_backends: List["_Backend"] = []
+        while True:
+            try:
+                with self._route(exclude=failed_backends) as backend:
+                    response = self._session(backend).post(
+                        f"{self._blocking_url(backend)}/api/v1/generate",
+                        json=request,
+                        timeout=self.request_timeout,
+                    )
+
+                    if response.status_code == 200:
+                        result = response.json()["results"][0]["text"]
+                    else:
+                        raise ConnectionError(_describe_failed_response(response))
+
+                    if result == "" and self._model_info(backend)["model_name"] is None:
+                        raise ValueError("No model is loaded!")
+                return result
+            except Exception as e:
+                if not self._should_reroute(e, backend, failed_backends):
+                    raise
+
+    async def _acall(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> str:
+        """Async version of `_call`, which sends requests through a pooled async http client.
+
+        Example:
+            .. code-block:: python
+
+                from langchain_setup.textgen import TextGen
+                llm = TextGen()
+                await llm.abatch(["Write a story about llamas."] * 100)
+        """
+        if self.streaming:
+            result = ""
+            async for chunk in self._astream(
+                prompt=prompt, stop=stop, run_manager=run_manager, **kwargs
+            ):
+                result += chunk.text
+            return result
 
-        url = f"http://{self.host_name_or_address}:{self.api_blocking_port}/api/v1/generate"
         params = self._get_parameters(stop)
         request = params.copy()
         request["prompt"] = prompt
-        response = requests.post(url, json=request)
+        if self._coalescable:
+            return await single_flight.ado(
+                self._coalescing_key(request),
+                lambda: self._arequest_generation(request),
+            )
+        return await self._arequest_generation(request)
+
+    async def _arequest_generation(self, request: Dict[str, Any]) -> str:
+        failed_backends: List["_Backend"] = []
+        while True:
+            try:
+                async with self._aroute(exclude=failed_backends) as backend:
+                    response = await self._apost(
+                        backend, "/api/v1/generate", json=request
+                    )
+
+                    if response.status_code == 200:
+                        result = response.json()["results"][0]["text"]
+                    else:
+                        raise ConnectionError(_describe_failed_response(response))
+
+                    if (
+                        result == ""
+                        and (await self._amodel_info(backend))["model_name"] is None
+                    ):
+                        raise ValueError("No model is loaded!")
+                return result
+            except Exception as e:
+                if not self._should_reroute(e, backend, failed_backends):
+                    raise
+
+    def _should_reroute(
+        self, error: Exception, backend: "_Backend", failed_backends: List["_Backend"]
+    ) -> bool:
+        """Whether to send the request to another backend, because it was never sent to `backend`, which failed at
+        connecting. Every backend is tried at most once."""
+        if not _is_connection_failure(error) or len(failed_backends) + 1 >= len(
+            self._backends
+        ):
+            return False
+        failed_backends.append(backend)
+        logger.warning(
+            f"Failed at connecting to {backend}, trying another backend: {error!r}"
+        )
+        return True
+
+    @property
+    def _coalescable(self) -> bool:
+        return (
+            self.coalesce_requests
+            and not self.streaming
+            and is_deterministic(self.temperature, self.do_sample)
+        )
+
+    def _coalescing_key(self, request: Dict[str, Any]) -> str:
+        # Requests to any of the same backends are interchangeable.
+        return json.dumps(
+            [sorted(str(backend) for backend in self._backends), request],
+            sort_keys=True,
+        )
+
+    def _stream(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> Iterator[GenerationChunk]:
+        """Yields results objects as they are generated in real time.
+
+        It uses the websocket of the streaming api, which sends an `text_stream` event for every new token and
+        a `stream_end` event when the generation is done.
+
+        Args:
+            prompt: The prompt to use for generation.
+            stop: A list of strings to stop generation when encountered.
+
+        Yields:
+            A generation chunk for every new token.
+
+        Example:
+            .. code-block:: python
+
+                from langchain_setup.textgen import TextGen
+                llm = TextGen()
+                for chunk in llm.stream("Ask 'Hi, how are you?' like a pirate:'"):
+                    print(chunk, end="", flush=True)
+        """
+        import websocket
+
+        request = self._get_parameters(stop)
+        request["prompt"] = prompt
 
-        if response.status_code == 200:
-            result = response.json()["results"][0]["text"]
+        with self._route() as backend:
+            websocket_client = websocket.create_connection(
+                self._streaming_url(backend), timeout=self.request_timeout
+            )
+            try:
+                websocket_client.send(json.dumps(request))
+                while True:
+                    message = json.loads(websocket_client.recv())
+                    if message["event"] == "text_stream":
+                        chunk = GenerationChunk(text=message["text"])
+                        yield chunk
+                        if run_manager:
+                            run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+                    elif message["event"] == "stream_end":
+                        return
+            finally:
+                websocket_client.close()
+
+    async def _astream(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[GenerationChunk]:
+        """Async version of `_stream`."""
+        import websockets
+
+        request = self._get_parameters(stop)
+        request["prompt"] = prompt
+
+        async with self._aroute() as backend:
+            async with websockets.connect(
+                self._streaming_url(backend), open_timeout=self.request_timeout
+            ) as websocket_client:
+                await websocket_client.send(json.dumps(request))
+                while True:
+                    message = json.loads(
+                        await asyncio.wait_for(
+                            websocket_client.recv(), timeout=self.request_timeout
+                        )
+                    )
+                    if message["event"] == "text_stream":
+                        chunk = GenerationChunk(text=message["text"])
+                        yield chunk
+                        if run_manager:
+                            await run_manager.on_llm_new_token(
+                                chunk.text, chunk=chunk
+                            )
+                    elif message["event"] == "stream_end":
+                        return
+
+    def model_info(self, refresh: bool = False) -> Dict[str, Any]:
+        """Get the info of the model loaded on the (first) backend, which is cached for `model_info_ttl` seconds.
+
+        An expired cache is still returned while it is being refreshed in a background thread, so this doesn't block
+        the generation. Failed generations also expire the cache.
+
+        Args:
+            refresh: Whether to wait for the latest info instead of using the cache.
+        """
+        return self._model_info(self._backends[0], refresh=refresh)
+
+    async def amodel_info(self, refresh: bool = False) -> Dict[str, Any]:
+        """Async version of `model_info`."""
+        return await self._amodel_info(self._backends[0], refresh=refresh)
+
+    @property
+    def model_status(self) -> Dict[str, Any]:
+        """Cached model and health state of the (first) backend, for monitoring. It never waits for a request: expired
+        info is refreshed in the background, and shows in the next reads. `healthy` is None until the backend has
+        answered or failed."""
+        self._refresh_expired_model_info(self._backends[0])
+        return self._backends[0].model_status.to_dict()
+
+    @property
+    def backend_stats(self) -> List[Dict[str, Any]]:
+        """Load balancing statistics and cached model state of every backend, for monitoring."""
+        for backend in self._backends:
+            self._refresh_expired_model_info(backend)
+        return [backend.to_dict() for backend in self._backends]
+
+    def _model_info(self, backend: "_Backend", refresh: bool = False):
+        status = backend.model_status
+        if refresh or status.info is None:
+            return self._fetch_model_info(backend)
+        if status.expired(self.model_info_ttl):
+            self._refresh_model_info_in_background(backend)
+        return status.info
+
+    async def _amodel_info(self, backend: "_Backend", refresh: bool = False):
+        status = backend.model_status
+        if refresh or status.info is None:
+            try:
+                response = await self._apost(
+                    backend, "/api/v1/model", json={"action": "info"}
+                )
+                if response.status_code != 200:
+                    raise ConnectionError(_describe_failed_response(response))
+                info = response.json()["result"]
+            except Exception as e:
+                status.set_error(e)
+                raise
+            status.set_info(info)
+            return info
+        if status.expired(self.model_info_ttl):
+            self._refresh_model_info_in_background(backend)
+        return status.info
+
+    def _fetch_model_info(self, backend: "_Backend") -> Dict[str, Any]:
+        status = backend.model_status
+        try:
+            response = self._session(backend).post(
+                f"{self._blocking_url(backend)}/api/v1/model",
+                json={"action": "info"},
+                timeout=self.request_timeout,
+            )
+            if response.status_code != 200:
+                raise ConnectionError(_describe_failed_response(response))
+            info = response.json()["result"]
+        except Exception as e:
+            status.set_error(e)
+            raise
+        status.set_info(info)
+        return info
+
+    def _refresh_expired_model_info(self, backend: "_Backend"):
+        """Refresh the model info in the background if it expired or was never fetched, unless the backend is
+        ejected."""
+        if backend.model_status.expired(self.model_info_ttl) and backend.ejected_until <= time.time():
+            self._refresh_model_info_in_background(backend)
+
+    def _refresh_model_info_in_background(self, backend: "_Backend"):
+        status = backend.model_status
+        with status.lock:
+            if status.refreshing:
+                return
+            status.refreshing = True
+
+        def refresh():
+            try:
+                self._fetch_model_info(backend)
+            except Exception as e:
+                logger.warning(f"Failed at refreshing model info of {backend}: {e!r}")
+            finally:
+                status.refreshing = False
+
+        threading.Thread(target=refresh, daemon=True).start()
+
+    @property
+    def _backends(self) -> List["_Backend"]:
+        if not self._backend_list:
+            specs = self.backends or [self.host_name_or_address]
+            self._backend_list = [
+                _get_backend(
+                    *_parse_backend(
+                        spec, self.api_blocking_port, self.api_streaming_port
+                    )
+                )
+                for spec in specs
+            ]
+        return self._backend_list
+
+    def _choose_backend(self, exclude: Sequence["_Backend"] = ()) -> "_Backend":
+        """Choose the backend with the least outstanding requests, skipping ejected backends and `exclude`."""
+        now = time.time()
+        with _backends_lock:
+            candidates = [b for b in self._backends if b not in exclude] or self._backends
+            available = [b for b in candidates if b.ejected_until <= now]
+            if not available:
+                # Fail open: try the backend which will come back the soonest.
+                available = [min(candidates, key=lambda b: b.ejected_until)]
+            backend = min(available, key=lambda b: (b.in_flight, b.latency or 0))
+            backend.in_flight += 1
+        return backend
+
+    @contextmanager
+    def _route(self, exclude: Sequence["_Backend"] = ()) -> Iterator["_Backend"]:
+        """Route a request to a backend other than `exclude`, and record its latency or failure."""
+        backend = self._choose_backend(exclude)
+        # The model info is fetched at the first use of the backend, and kept fresh for monitoring.
+        self._refresh_expired_model_info(backend)
+        start_time = time.time()
+        try:
+            yield backend
+        except Exception as e:
+            backend.record_failure(
+                e, self.backend_max_failures, self.backend_cooldown
+            )
+            raise
         else:
-            raise ConnectionError(str(response))
+            backend.record_success(time.time() - start_time)
+        finally:
+            with _backends_lock:
+                backend.in_flight -= 1
+
+    @asynccontextmanager
+    async def _aroute(
+        self, exclude: Sequence["_Backend"] = ()
+    ) -> AsyncIterator["_Backend"]:
+        """Async version of `_route`."""
+        with self._route(exclude) as backend:
+            yield backend
+
+    async def _apost(self, backend: "_Backend", path: str, json: Dict[str, Any]):
+        """Post with the same retry policy as the one mounted on `_session`."""
+        import httpx
+
+        for retry_number in range(self.max_retries + 1):
+            if retry_number > 0:
+                await asyncio.sleep(
+                    self.retry_backoff_factor * 2 ** (retry_number - 1)
+                )
+            try:
+                response = await self._async_client(backend).post(path, json=json)
+            except (httpx.ConnectError, httpx.ConnectTimeout):
+                if retry_number == self.max_retries:
+                    raise
+                continue
+            if response.status_code not in RETRY_STATUS_CODES:
+                break
+        return response
+
+    def _blocking_url(self, backend: "_Backend") -> str:
+        host, port = self._address(backend.host, backend.blocking_port)
+        return f"http://{host}:{port}"
+
+    def _streaming_url(self, backend: "_Backend") -> str:
+        host, port = self._address(backend.host, backend.streaming_port)
+        return f"ws://{host}:{port}/api/v1/stream"
+
+    def _address(self, host: str, port: int):
+        """Get the address to connect to the api on `port`, which is a local end of a SSH tunnel if `via_ssh`."""
+        if not self.via_ssh:
+            return host, port
+        if (host, port) not in self._ssh_tunnels:
+            with _ssh_tunnel_registry.lock:
+                if (host, port) not in self._ssh_tunnels:
+                    key = (_resolve_ssh_host_name(host), port)
+                    local_port = _ssh_tunnel_registry.acquire(key)
+                    finalizer = weakref.finalize(
+                        self, _ssh_tunnel_registry.release, key
+                    )
+                    self._ssh_tunnels[(host, port)] = (local_port, finalizer)
+        return "127.0.0.1", self._ssh_tunnels[(host, port)][0]
+
+    def close(self):
+        """Release the SSH tunnels used by this instance. Tunnels no longer used by any instance are stopped."""
+        for _, finalizer in self._ssh_tunnels.values():
+            finalizer()
+        self._ssh_tunnels.clear()
+
+    def _session(self, backend: "_Backend") -> requests.Session:
+        return _get_session(
+            base_url=self._blocking_url(backend),
+            pool_maxsize=self.max_connections,
+            max_retries=self.max_retries,
+            retry_backoff_factor=self.retry_backoff_factor,
+        )
 
-        if result == "" and self.model_info()["model_name"] is None:
-            raise ValueError("No model is loaded!")
+    def _async_client(self, backend: "_Backend"):
+        return _get_async_client(
+            base_url=self._blocking_url(backend),
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.max_keepalive_connections,
+            timeout=self.request_timeout,
+        )
 
-        return result
 
-    def model_info(self):
-        result = requests.post(
-            f"http://{self.host_name_or_address}:{self.api_blocking_port}/api/v1/model",
-            json={"action": "info"},
-        ).json()["result"]
-        return result
+class PartialGenerationError(Exception):
+    """Some prompts of a batch failed. The generations of the others are kept in `llm_result`."""
+
+    def __init__(self, results: List[Any]):
+        self.results = results
+        """Generated text, or the exception raised, of every prompt."""
+        self.errors: Dict[int, BaseException] = {
+            i: result for i, result in enumerate(results) if isinstance(result, BaseException)
+        }
+        """Index of the prompt -> the exception raised."""
+        first_index, first_error = next(iter(self.errors.items()))
+        super().__init__(
+            f"{len(self.errors)} of {len(results)} prompts failed, "
+            f"e.g. prompt {first_index}: {first_error!r}"
+        )
+
+    @property
+    def llm_result(self) -> LLMResult:
+        """Generations of all the prompts, which are empty with the error in `generation_info["error"]` for the
+        prompts failed."""
+        return LLMResult(
+            generations=[
+                [Generation(text="", generation_info={"error": repr(result)})]
+                if isinstance(result, BaseException)
+                else [Generation(text=result)]
+                for result in self.results
+            ]
+        )
+
+
+def _results_to_llm_result(
+    results: List[Any], return_failed_generations: bool = False
+) -> LLMResult:
+    errors = [result for result in results if isinstance(result, BaseException)]
+    if not errors:
+        return LLMResult(generations=[[Generation(text=result)] for result in results])
+    if len(errors) == len(results):
+        raise errors[0]
+    error = PartialGenerationError(results)
+    if not return_failed_generations:
+        raise error from errors[0]
+    for i, result in error.errors.items():
+        logger.warning(f"Generation for prompt {i} of the batch failed: {result!r}")
+    return error.llm_result
+
+
+class _ModelStatus:
+    """Model info of a server cached along with its health."""
+
+    def __init__(self):
+        self.info: Optional[Dict[str, Any]] = None
+        self.updated_at: Optional[float] = None
+        self.last_error: Optional[BaseException] = None
+        self.observed = False
+        """Whether any request to the server has succeeded or failed yet."""
+        self.refreshing = False
+        self.lock = threading.Lock()
+
+    def expired(self, ttl: float) -> bool:
+        return self.updated_at is None or time.time() - self.updated_at > ttl
+
+    def set_info(self, info: Dict[str, Any]):
+        self.info, self.updated_at, self.last_error = info, time.time(), None
+        self.observed = True
+
+    def set_healthy(self):
+        self.last_error, self.observed = None, True
+
+    def set_error(self, error: BaseException):
+        self.updated_at, self.last_error = None, error
+        self.observed = True
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "model_name": self.info["model_name"] if self.info else None,
+            "healthy": self.last_error is None if self.observed else None,
+            "updated_at": self.updated_at,
+            "last_error": repr(self.last_error) if self.last_error else None,
+        }
+
+
+class _Backend:
+    """A text-generation-webui server, shared by instances pointing at it so that they balance the load together."""
+
+    def __init__(self, host: str, blocking_port: int, streaming_port: int):
+        self.host, self.blocking_port, self.streaming_port = (
+            host,
+            blocking_port,
+            streaming_port,
+        )
+        self.model_status = _ModelStatus()
+        self.in_flight = 0
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.latency: Optional[float] = None  # exponential moving average in seconds
+        self.ejected_until = 0.0
+
+    def __str__(self):
+        return f"{self.host}:{self.blocking_port}:{self.streaming_port}"
+
+    def record_success(self, latency: float):
+        with _backends_lock:
+            self.requests += 1
+            self.consecutive_failures = 0
+            self.model_status.set_healthy()
+            self.latency = (
+                latency
+                if self.latency is None
+                else LATENCY_SMOOTHING * latency
+                + (1 - LATENCY_SMOOTHING) * self.latency
+            )
+
+    def record_failure(self, error: BaseException, max_failures: int, cooldown: float):
+        with _backends_lock:
+            self.requests += 1
+            self.failures += 1
+            self.consecutive_failures += 1
+            # Once ejected, a backend is ejected again by the first failure after it comes back.
+            if self.consecutive_failures >= max_failures:
+                self.ejected_until = time.time() + cooldown
+                logger.warning(
+                    f"Backend {self} is ejected for {cooldown} seconds "
+                    f"after {self.consecutive_failures} consecutive failures: {error!r}"
+                )
+        self.model_status.set_error(error)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "backend": str(self),
+            "in_flight": self.in_flight,
+            "requests": self.requests,
+            "failures": self.failures,
+            "latency": self.latency,
+            "ejected": self.ejected_until > time.time(),
+            **self.model_status.to_dict(),
+        }
+
+
+LATENCY_SMOOTHING = 0.2
+
+_backends: Dict[tuple, _Backend] = {}
+_backends_lock = threading.RLock()
+
+
+def _get_backend(host: str, blocking_port: int, streaming_port: int) -> _Backend:
+    with _backends_lock:
+        key = (host, blocking_port, streaming_port)
+        if key not in _backends:
+            _backends[key] = _Backend(*key)
+        return _backends[key]
+
+
+def _parse_backend(spec: str, default_blocking_port: int, default_streaming_port: int):
+    """Parse `host[:blocking_port[:streaming_port]]`."""
+    host, *ports = spec.split(":")
+    if len(ports) > 2:
+        raise ValueError(
+            f"Backend `{spec}` is not in the form of `host[:blocking_port[:streaming_port]]`."
+        )
+    blocking_port = int(ports[0]) if len(ports) >= 1 else default_blocking_port
+    streaming_port = int(ports[1]) if len(ports) == 2 else default_streaming_port
+    return host, blocking_port, streaming_port
+
+
+RETRY_STATUS_CODES = (500, 502, 503, 504)
+
+_sessions: Dict[tuple, requests.Session] = {}
+_sessions_lock = threading.Lock()
+
+
+def _get_session(base_url, pool_maxsize, max_retries, retry_backoff_factor):
+    """Get the keep-alive session shared by instances pointing at the same host and port."""
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    key = (base_url, pool_maxsize, max_retries, retry_backoff_factor)
+    with _sessions_lock:
+        if key not in _sessions:
+            # Generation is not idempotent, so it is retried only when it was surely not run: when the connection
+            # failed, or the server answered with a 5xx status. A read timeout is not retried.
+            retry = Retry(
+                total=max_retries,
+                connect=max_retries,
+                read=0,
+                status=max_retries,
+                other=0,
+                backoff_factor=retry_backoff_factor,
+                status_forcelist=RETRY_STATUS_CODES,
+                allowed_methods=None,  # generation requests are POST, which is not retried by default
+                raise_on_status=False,
+            )
+            session = requests.Session()
+            session.mount(
+                "http://",
+                HTTPAdapter(
+                    pool_connections=1, pool_maxsize=pool_maxsize, max_retries=retry
+                ),
+            )
+            _sessions[key] = session
+        return _sessions[key]
+
+
+def _is_connection_failure(error: BaseException) -> bool:
+    """Whether the request failed at connecting to the server, so it was surely not sent."""
+    import httpx
+    from urllib3.exceptions import MaxRetryError, NewConnectionError
+
+    if isinstance(error, (httpx.ConnectError, httpx.ConnectTimeout, requests.ConnectTimeout)):
+        return True
+    if isinstance(error, requests.ConnectionError):
+        reason = error.args[0] if error.args else None
+        if isinstance(reason, MaxRetryError):
+            reason = reason.reason
+        return isinstance(reason, NewConnectionError)
+    return False
+
+
+def _describe_failed_response(response) -> str:
+    return f"Request to {response.url} failed with status {response.status_code}: {response.text}"
+
+
+# Async clients are bound to the event loop they are created in, so we keep one per loop.
+_async_clients: Dict[tuple, tuple] = {}
+_async_client_closers: Dict[int, tuple] = {}
+
+
+def _get_async_client(base_url, max_connections, max_keepalive_connections, timeout):
+    import httpx
+
+    loop = asyncio.get_running_loop()
+    for key, (client_loop, _) in list(_async_clients.items()):
+        if client_loop.is_closed():
+            # Only reached if the loop was closed without `shutdown_asyncgens`, when the client can't be closed.
+            del _async_clients[key]
+    for loop_id, (closer_loop, _) in list(_async_client_closers.items()):
+        if closer_loop.is_closed():
+            del _async_client_closers[loop_id]
+
+    key = (id(loop), base_url, max_connections, max_keepalive_connections, timeout)
+    if key not in _async_clients or _async_clients[key][1].is_closed:
+        client = httpx.AsyncClient(
+            base_url=base_url,
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive_connections,
+            ),
+            timeout=httpx.Timeout(timeout),
+        )
+        _async_clients[key] = (loop, client)
+        _close_async_clients_on_shutdown(loop)
+    return _async_clients[key][1]
+
+
+def _close_async_clients_on_shutdown(loop: asyncio.AbstractEventLoop):
+    """Close the clients of the loop when the loop shuts down, e.g. at the end of every `asyncio.run`."""
+    if id(loop) in _async_client_closers:
+        return
+
+    async def closer():
+        try:
+            yield
+        finally:
+            await aclose_async_clients()
+
+    # Starting the async generator registers it to the loop, and `loop.shutdown_asyncgens`, called by `asyncio.run`
+    # before closing the loop, runs its `finally` while the loop still runs.
+    generator = closer()
+    try:
+        generator.__anext__().send(None)
+    except StopIteration:
+        pass
+    _async_client_closers[id(loop)] = (loop, generator)
+
+
+async def aclose_async_clients():
+    """Close the pooled async http clients of the running event loop. They are also closed automatically when the
+    loop shuts down by `asyncio.run`, so this is only needed for loops closed otherwise."""
+    loop = asyncio.get_running_loop()
+    clients = [
+        _async_clients.pop(key)[1]
+        for key, (client_loop, _) in list(_async_clients.items())
+        if client_loop is loop
+    ]
+    for client in clients:
+        await client.aclose()
 
 
 def get_curreent_ip():
@@ -327,19 +1093,73 @@ def get_curreent_ip():
     return ip
 
 
-def _setup_ssh_tunnels(ssh_host_name, api_blocking_port, api_streaming_port):
-    from sshtunnel import SSHTunnelForwarder
-
-    api_blocking_tunnel = SSHTunnelForwarder(
-        ssh_address_or_host=ssh_host_name,
-        remote_bind_address=("127.0.0.1", api_blocking_port),
-    )
-    api_blocking_tunnel.start()
-
-    api_streaming_tunnel = SSHTunnelForwarder(
-        ssh_address_or_host=ssh_host_name,
-        remote_bind_address=("127.0.0.1", api_streaming_port),
-    )
-    api_streaming_tunnel.start()
-
-    return api_blocking_tunnel, api_streaming_tunnel
+@lru_cache(maxsize=None)
+def _resolve_ssh_host_name(host_name_or_address: str) -> str:
+    from sshconf import read_ssh_config_file
+
+    ssh_cfg = read_ssh_config_file(os.path.expanduser("~/.ssh/config"))
+    ssh_hostnames = [
+        host
+        for host in ssh_cfg.hosts()
+        if host == host_name_or_address
+        or socket.gethostbyname(ssh_cfg.host(host).get("hostname", host))
+        == host_name_or_address
+    ]
+    if len(ssh_hostnames) == 0:
+        raise ValueError(
+            f"Did not find any SSH host name corresponds to {host_name_or_address} in `~/.ssh/config`."
+        )
+    elif len(ssh_hostnames) > 1:
+        raise ValueError(
+            f"Multiple SSH host {ssh_hostnames} correspond to {host_name_or_address} in `~/.ssh/config`."
+        )
+    return ssh_hostnames[0]
+
+
+class _SSHTunnelRegistry:
+    """SSH tunnels shared in the process, keyed by (SSH host name, remote port) and reference counted."""
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self._tunnels: Dict[tuple, list] = {}  # key -> [tunnel, reference count]
+        atexit.register(self.close_all)
+
+    def acquire(self, key) -> int:
+        """Get the local bind port of the tunnel, which is started if it isn't running."""
+        from sshtunnel import SSHTunnelForwarder
+
+        ssh_host_name, remote_port = key
+        with self.lock:
+            if key not in self._tunnels:
+                self._tunnels[key] = [None, 0]
+            entry = self._tunnels[key]
+            if entry[0] is None or not entry[0].is_active:
+                entry[0] = SSHTunnelForwarder(
+                    ssh_address_or_host=ssh_host_name,
+                    remote_bind_address=("127.0.0.1", remote_port),
+                )
+                entry[0].start()
+                logger.info(
+                    f"SSH tunnel localhost:{entry[0].local_bind_port} -> {ssh_host_name}:{remote_port} is started."
+                )
+            entry[1] += 1
+            return entry[0].local_bind_port
+
+    def release(self, key):
+        with self.lock:
+            entry = self._tunnels.get(key)
+            if entry is None:
+                return
+            entry[1] -= 1
+            if entry[1] <= 0:
+                del self._tunnels[key]
+                entry[0].stop()
+
+    def close_all(self):
+        with self.lock:
+            for tunnel, _ in self._tunnels.values():
+                tunnel.stop()
+            self._tunnels.clear()
+
+
+_ssh_tunnel_registry = _SSHTunnelRegistry()
@@ -0,0 +1,51 @@
+"""Count tokens with tiktoken, falling back to an estimate by characters where tiktoken is not available."""
+import logging, math
+from typing import Any, Callable
+
+logger = logging.getLogger(__name__)
+
+CHARACTERS_PER_TOKEN = 4
+"""Rough estimate used when tiktoken is not available."""
+_tiktoken_unavailable = False
+
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / CHARACTERS_PER_TOKEN)
+
+
+def count_tokens(count: Callable[[], int], text: str) -> int:
+    """Return `count()`, which counts tokens of `text` with tiktoken, or estimate them if tiktoken failed."""
+    if not _tiktoken_unavailable:
+        try:
+            return count()
+        except Exception as e:
+            _fall_back_to_characters(e)
+    return estimate_tokens(text)
+
+
+def tiktoken_counter(llm: Any) -> Callable[[str], int]:
+    """Count tokens of a text with the tiktoken encoding of `llm`'s model, `cl100k_base` for other models, or
+    estimate them if tiktoken failed."""
+    if not _tiktoken_unavailable:
+        try:
+            import tiktoken
+
+            model_name = getattr(llm, "tiktoken_model_name", None) or getattr(llm, "model_name", None)
+            encoding = None
+            if model_name:
+                try:
+                    encoding = tiktoken.encoding_for_model(model_name)
+                except KeyError:
+                    pass
+            encoding = encoding or tiktoken.get_encoding("cl100k_base")
+            return lambda text: len(encoding.encode(text, disallowed_special=()))
+        except Exception as e:
+            _fall_back_to_characters(e)
+    return estimate_tokens
+
+
+def _fall_back_to_characters(error: Exception):
+    global _tiktoken_unavailable
+    # tiktoken downloads encodings at the first use, which fails offline.
+    logger.warning(f"Estimate tokens by characters, because tiktoken failed: {error!r}")
+    _tiktoken_unavailable = True
@@ -0,0 +1,183 @@
+"""Local tracing of runs to a JSONL file, for environments without LangSmith."""
+import json, logging, os, queue, threading
+from collections import defaultdict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+from langchain.callbacks.manager import run_collector_var
+from langchain.callbacks.tracers.base import BaseTracer
+from langchain.callbacks.tracers.schemas import Run
+
+from .cache import DEFAULT_CACHE_DIR
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TRACES_DIR = DEFAULT_CACHE_DIR / "traces"
+
+
+class LocalTracer(BaseTracer):
+    """Tracer writing every run of finished traces as a JSON line, with its latency, time to first token and token
+    counts, and its position in the run tree (`trace_id`, `parent_run_id`).
+
+    Runs are serialized and written by a background thread, so callbacks of chains and models are not blocked by
+    the file.
+
+    Example:
+        .. code-block:: python
+
+            with local_tracing_enabled("chatbot") as tracer:
+                chain.invoke({"question": "..."})
+            tracer.print_summary()
+    """
+
+    def __init__(self, path, project_name: Optional[str] = None, **kwargs: Any):
+        """
+        Args:
+            path: Path of the JSONL file, which is appended to.
+            project_name: Recorded in every run, to tell apart runs of different projects in the same file.
+        """
+        super().__init__(**kwargs)
+        self.path = Path(path).expanduser()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.project_name = project_name
+        self._queue: "queue.Queue[Optional[Run]]" = queue.Queue()
+        self._records: List[Dict[str, Any]] = []
+        self._writer = threading.Thread(
+            target=self._write_runs, name="local-tracer", daemon=True
+        )
+        self._writer.start()
+
+    def _persist_run(self, run: Run) -> None:
+        # Only root runs are persisted, with the whole run tree in `child_runs`.
+        self._queue.put(run)
+
+    def close(self):
+        """Wait until all traces are written, and stop the writer thread."""
+        if self._writer.is_alive():
+            self._queue.put(None)
+            self._writer.join()
+
+    def summary(self) -> Dict[str, Dict[str, Any]]:
+        """Count, p50/p95 latency, p50/p95 time to first token and total tokens of runs written, by run name."""
+        groups = defaultdict(list)
+        for record in self._records:
+            groups[f"{record['run_type']}:{record['name']}"].append(record)
+        return {
+            name: {
+                "count": len(records),
+                "latency_p50_ms": _percentile([r["latency_ms"] for r in records], 50),
+                "latency_p95_ms": _percentile([r["latency_ms"] for r in records], 95),
+                "first_token_p50_ms": _percentile(
+                    [r["first_token_ms"] for r in records], 50
+                ),
+                "first_token_p95_ms": _percentile(
+                    [r["first_token_ms"] for r in records], 95
+                ),
+                "total_tokens": sum(r["total_tokens"] or 0 for r in records),
+            }
+            for name, records in groups.items()
+        }
+
+    def print_summary(self):
+        summary = self.summary()
+        if not summary:
+            print("[Local traces]: No runs were traced.")
+            return
+
+        def ms(value):
+            return "-" if value is None else f"{value:.0f}"
+
+        print(f"[Local traces]: {self.path}")
+        print(
+            f"{'run':<40}{'count':>7}{'p50 ms':>9}{'p95 ms':>9}"
+            f"{'TTFT p50':>10}{'TTFT p95':>10}{'tokens':>9}"
+        )
+        for name, stats in sorted(summary.items()):
+            print(
+                f"{name[:39]:<40}{stats['count']:>7}"
+                f"{ms(stats['latency_p50_ms']):>9}{ms(stats['latency_p95_ms']):>9}"
+                f"{ms(stats['first_token_p50_ms']):>10}{ms(stats['first_token_p95_ms']):>10}"
+                f"{stats['total_tokens']:>9}"
+            )
+
+    def _write_runs(self):
+        with open(self.path, "a", encoding="utf-8") as f:
+            while True:
+                run = self._queue.get()
+                if run is None:
+                    break
+                try:
+                    records = list(_flatten_run(run, trace_id=str(run.id)))
+                    for record in records:
+                        record["project_name"] = self.project_name
+                        f.write(json.dumps(record, ensure_ascii=False, default=str))
+                        f.write("\n")
+                    f.flush()
+                    self._records.extend(records)
+                except Exception:
+                    logger.exception(f"Failed at writing the trace of run {run.id}.")
+
+
+def _flatten_run(run: Run, trace_id: str) -> Iterator[Dict[str, Any]]:
+    first_token_time = next(
+        (event["time"] for event in run.events if event.get("name") == "new_token"),
+        None,
+    )
+    new_tokens = sum(1 for event in run.events if event.get("name") == "new_token")
+    token_usage = ((run.outputs or {}).get("llm_output") or {}).get("token_usage") or {}
+    completion_tokens = token_usage.get("completion_tokens") or new_tokens or None
+    prompt_tokens = token_usage.get("prompt_tokens")
+    yield {
+        "id": str(run.id),
+        "trace_id": trace_id,
+        "parent_run_id": str(run.parent_run_id) if run.parent_run_id else None,
+        "name": run.name,
+        "run_type": run.run_type,
+        "start_time": run.start_time.isoformat(),
+        "end_time": run.end_time.isoformat() if run.end_time else None,
+        "latency_ms": (run.end_time - run.start_time).total_seconds() * 1000
+        if run.end_time
+        else None,
+        "first_token_ms": (first_token_time - run.start_time).total_seconds() * 1000
+        if first_token_time
+        else None,
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": token_usage.get("total_tokens")
+        or (prompt_tokens or 0) + (completion_tokens or 0)
+        or None,
+        "error": run.error,
+        "tags": run.tags,
+    }
+    for child_run in run.child_runs:
+        yield from _flatten_run(child_run, trace_id)
+
+
+def _percentile(values, percentile: float) -> Optional[float]:
+    values = sorted(value for value in values if value is not None)
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(len(values) * percentile / 100))]
+
+
+@contextmanager
+def local_tracing_enabled(
+    project_name: Optional[str] = None, path=None
+) -> Iterator[LocalTracer]:
+    """Trace all runs in the context with `LocalTracer`, in the same way as `collect_runs`.
+
+    Args:
+        project_name: Name of the project. Default to environment variable `LANGCHAIN_PROJECT` or "default".
+        path: Path of the JSONL file. Default to `~/.cache/langchain_setup/traces/<project_name>.jsonl`.
+    """
+    project_name = project_name or os.environ.get("LANGCHAIN_PROJECT") or "default"
+    tracer = LocalTracer(
+        path or DEFAULT_TRACES_DIR / f"{project_name}.jsonl", project_name=project_name
+    )
+    token = run_collector_var.set(tracer)
+    try:
+        yield tracer
+    finally:
+        run_collector_var.reset(token)
+        tracer.close()
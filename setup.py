@@ -21,6 +21,8 @@ REQUIRED_PKGS = [
     # # Text Generation Webui
     # 'sshconf',
     # 'sshtunnel',
+    # 'websocket-client', # for streaming
+    # 'websockets', # for async streaming
 ]
 
 TUTORIAL_REQUIRED_PKGS = [
@@ -39,6 +41,7 @@ TUTORIAL_REQUIRED_PKGS = [
     'lark',
     'html2text',
     'rank_bm25',
+    'scipy', # for langchain_setup.hybrid
     'duckduckgo-search',
 ]
 